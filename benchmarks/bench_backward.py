@@ -0,0 +1,40 @@
+# 反向传播的时间随计算图深度的变化（链式图和菱形图）
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import numpy as np
+from dezero import Variable
+import dezero.functions as F
+
+
+def chain(x, depth):
+    y = x
+    for _ in range(depth):
+        y = F.sin(y)
+    return y
+
+
+def diamond(x, depth):
+    # 每一层分成两支再合并：y -> (sin(y), cos(y)) -> 相加
+    y = x
+    for _ in range(depth):
+        y = F.sin(y) + F.cos(y)
+    return y
+
+
+def measure(build, depth):
+    x = Variable(np.array(0.5))
+    y = build(x, depth)
+    start = time.perf_counter()
+    y.backward()
+    return time.perf_counter() - start
+
+
+for build in (chain, diamond):
+    print(build.__name__)
+    for depth in (1000, 2000, 4000, 8000, 16000):
+        t = measure(build, depth)
+        print('  depth={:6d}  backward={:.4f}s  per node={:.2f}us'.format(
+            depth, t, t / depth * 1e6))
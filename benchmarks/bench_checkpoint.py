@@ -0,0 +1,42 @@
+# 深层tanh(matmul)链上，普通反向传播与每k层做checkpoint的峰值内存和时间
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import tracemalloc
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+np.random.seed(0)
+depth, batch, size = 64, 512, 256
+Ws = [Variable(np.random.randn(size, size) / np.sqrt(size)) for _ in range(depth)]
+layers = [lambda h, W=W: F.tanh(F.matmul(h, W)) for W in Ws]
+
+
+def run(k):
+    x = Variable(np.random.rand(batch, size))
+    if k is None:
+        h = x
+        for layer in layers:
+            h = layer(h)
+    else:
+        h = dezero.checkpoint_sequential(layers, k, x)
+    loss = F.sum(h)
+    loss.backward()
+    return x.grad.data
+
+
+for k in (None, 16, 8, 4):
+    tracemalloc.start()
+    start = time.perf_counter()
+    g = run(k)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    for W in Ws:
+        W.cleargrad()
+    print('{:<14} peak={:7.1f}MB  time={:.3f}s'.format(
+        'no checkpoint' if k is None else 'k={}'.format(k), peak / 2**20, elapsed))
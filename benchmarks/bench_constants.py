@@ -0,0 +1,44 @@
+# 标量常量作为函数属性与作为计算图输入的对比（rosenbrock的梯度下降，每秒迭代次数）
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import numpy as np
+from dezero import Variable
+
+
+def rosenbrock(x0, x1):
+    # 标量写成字面量，走AddConstant/MulConstant等
+    return 100 * (x1 - x0 ** 2) ** 2 + (x0 - 1) ** 2
+
+
+_100 = np.array(100.0)
+_1 = np.array(1.0)
+
+def rosenbrock_operands(x0, x1):
+    # 标量先转换为ndarray，和以前一样作为计算图的输入，反向传播也为它求梯度
+    return _100 * (x1 - x0 ** 2) ** 2 + (x0 - _1) ** 2
+
+
+def run(fn, iters=20000, lr=0.001):
+    x0 = Variable(np.array(0.0))
+    x1 = Variable(np.array(2.0))
+    start = time.perf_counter()
+    for _ in range(iters):
+        y = fn(x0, x1)
+        x0.cleargrad()
+        x1.cleargrad()
+        y.backward()
+        x0.data = x0.data - lr * x0.grad.data
+        x1.data = x1.data - lr * x1.grad.data
+    elapsed = time.perf_counter() - start
+    return iters / elapsed, x0.data, x1.data
+
+
+base, a0, a1 = run(rosenbrock_operands)
+const, b0, b1 = run(rosenbrock)
+assert np.allclose(a0, b0) and np.allclose(a1, b1)
+print('constants as inputs    : {:8.0f} iters/s  x0={:.6f} x1={:.6f}'.format(base, a0, a1))
+print('constants as attributes: {:8.0f} iters/s  x0={:.6f} x1={:.6f}'.format(const, b0, b1))
+print('speedup: {:.2f}x'.format(const / base))
@@ -0,0 +1,41 @@
+# MatMul为主的训练循环在不同数据类型下的吞吐量
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import contextlib
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+
+def train(dtype, policy, batch=256, size=512, iters=20):
+    np.random.seed(0)
+    x = Variable(np.random.randn(batch, size).astype(dtype))
+    t = Variable(np.random.randn(batch, size).astype(dtype))
+    W1 = Variable((np.random.randn(size, size) * 0.01).astype(dtype))
+    W2 = Variable((np.random.randn(size, size) * 0.01).astype(dtype))
+
+    with policy:
+        start = time.perf_counter()
+        for i in range(iters):
+            y = F.matmul(F.tanh(F.matmul(x, W1)), W2)
+            loss = F.mean_squared_error(y, t)
+            W1.cleargrad()
+            W2.cleargrad()
+            loss.backward()
+            for W in (W1, W2):
+                W.data -= (0.1 * W.grad.data).astype(W.data.dtype)
+        elapsed = time.perf_counter() - start
+    return iters / elapsed, loss.dtype, W1.grad.dtype
+
+
+# 注意：NumPy的float16矩阵乘法没有BLAS实现，混合精度在这里只节省内存，速度很慢
+for name, dtype, policy, iters in [
+        ('float64', np.float64, contextlib.nullcontext(), 20),
+        ('float32', np.float32, dezero.using_config('dtype', np.float32), 20),
+        ('float16/float32', np.float16, dezero.mixed_precision(), 2)]:
+    its, data_dtype, grad_dtype = train(dtype, policy, iters=iters)
+    print('{:<16} {:8.1f} it/s  data={} grad={}'.format(name, its, data_dtype, grad_dtype))
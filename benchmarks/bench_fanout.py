@@ -0,0 +1,36 @@
+# 同一个参数被很多函数使用时，反向传播的峰值内存和时间
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import tracemalloc
+import numpy as np
+from dezero import Variable
+import dezero.functions as F
+
+
+def fanout(n_uses, size=256):
+    np.random.seed(0)
+    W = Variable(np.random.randn(size, size))
+    xs = [Variable(np.random.randn(1, size)) for _ in range(n_uses)]
+    y = F.sum(F.matmul(xs[0], W))
+    for x in xs[1:]:
+        y = y + F.sum(F.matmul(x, W))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    y.backward()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    expected = sum(x.data for x in xs).T * np.ones((1, size))
+    assert np.allclose(W.grad.data, expected)
+    return elapsed, peak / W.data.nbytes
+
+
+for n_uses in (8, 32, 128, 512):
+    t, peak = fanout(n_uses)
+    # 原地累加时，峰值内存不随使用次数增长（以W的大小为单位）
+    print('uses={:4d}  backward={:.4f}s  peak memory={:.1f} x W'.format(n_uses, t, peak))
@@ -0,0 +1,41 @@
+# 大批量MatMul和Sum构成的计算图：反向传播时是否尽早释放前向数据的峰值内存
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import tracemalloc
+import numpy as np
+from dezero import Variable
+import dezero.functions as F
+
+
+def loss_fn(x, Ws):
+    h = x
+    for W in Ws:
+        h = F.tanh(F.matmul(h, W))
+    return F.sum(h)
+
+
+def measure(free_graph, batch=4096, size=256, depth=8):
+    np.random.seed(0)
+    x = Variable(np.random.randn(batch, size))
+    Ws = [Variable(np.random.randn(size, size) * 0.1) for _ in range(depth)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    loss = loss_fn(x, Ws)
+    loss.backward(free_graph=free_graph)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()  # loss还存活时计算图占用的内存
+    tracemalloc.stop()
+    return elapsed, peak, retained, Ws[0].grad.data
+
+
+t0, peak0, kept0, g0 = measure(free_graph=False)
+t1, peak1, kept1, g1 = measure(free_graph=True)
+assert np.allclose(g0, g1)
+print('free_graph=False: peak={:.1f}MB  retained={:.1f}MB  {:.3f}s'.format(
+    peak0 / 2**20, kept0 / 2**20, t0))
+print('free_graph=True : peak={:.1f}MB  retained={:.1f}MB  {:.3f}s'.format(
+    peak1 / 2**20, kept1 / 2**20, t1))
@@ -0,0 +1,38 @@
+# rosenbrock函数在大数组上：逐个节点重放 vs 融合逐元素运算后重放
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+
+
+def rosenbrock(x0, x1):
+    y = 100 * (x1 - x0 ** 2) ** 2 + (x0 - 1) ** 2
+    return y
+
+
+def run(fuse, n=1000000, iters=20):
+    np.random.seed(0)
+    x0 = Variable(np.random.rand(n))
+    x1 = Variable(np.random.rand(n))
+    f = dezero.trace(rosenbrock, fuse=fuse)
+    f(x0, x1)  # 第一次调用时记录计算图
+    program = next(iter(f.programs.values()))
+    start = time.perf_counter()
+    for i in range(iters):
+        x0.cleargrad()
+        x1.cleargrad()
+        y = f(x0, x1)
+        y.backward()
+    return time.perf_counter() - start, len(program.ops), x0.grad.data
+
+
+t0, n0, g0 = run(fuse=False)
+t1, n1, g1 = run(fuse=True)
+assert np.allclose(g0, g1)
+print('unfused: {} nodes  {:.4f}s'.format(n0, t0))
+print('fused  : {} nodes  {:.4f}s'.format(n1, t1))
+print('speedup: {:.2f}x'.format(t0 / t1))
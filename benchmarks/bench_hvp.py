@@ -0,0 +1,91 @@
+# 海森矩阵与向量的积：create_graph二次反向传播与hvp（forward-over-reverse）的时间和峰值内存，
+# 以及NewtonCG与梯度下降的收敛速度
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import tracemalloc
+import numpy as np
+import dezero
+from dezero import Variable
+from dezero.optimizers import NewtonCG
+import dezero.functions as F
+
+np.random.seed(0)
+X = np.random.randn(200, 50)
+T = np.sin(X[:, :1]) + 0.1 * np.random.randn(200, 1)
+
+
+def loss(W1, b1, W2, b2):
+    return F.mean_squared_error(F.linear(F.tanh(F.linear(X, W1, b1)), W2, b2), T)
+
+
+def init(hidden):
+    return [Variable(np.random.randn(50, hidden) * 0.1), Variable(np.zeros(hidden)),
+            Variable(np.random.randn(hidden, 1) * 0.1), Variable(np.zeros(1))]
+
+
+def double_backward(params, vs):
+    xs = [Variable(p.data) for p in params]
+    y = loss(*xs)
+    y.backward(create_graph=True)
+    gs = [x.grad for x in xs]
+    for x in xs:
+        x.cleargrad()
+    z = F.sum(gs[0] * vs[0])
+    for g, v in zip(gs[1:], vs[1:]):
+        z = z + F.sum(g * v)
+    z.backward()
+    return [x.grad.data for x in xs]
+
+
+def forward_over_reverse(params, vs):
+    return [h.data for h in dezero.hvp(loss, [p.data for p in params], vs)]
+
+
+def measure(fn, params, vs, iters=20):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(iters):
+        hs = fn(params, vs)
+    elapsed = (time.perf_counter() - start) / iters
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return hs, elapsed, peak
+
+
+for hidden in (16, 64, 256):
+    params = init(hidden)
+    vs = [np.random.randn(*p.shape) for p in params]
+    n = sum(p.data.size for p in params)
+    h0, t0, m0 = measure(double_backward, params, vs)
+    h1, t1, m1 = measure(forward_over_reverse, params, vs)
+    assert all(np.allclose(a, b) for a, b in zip(h0, h1))
+    print('params={:6d}  create_graph: {:7.2f}ms {:6.2f}MB  hvp: {:7.2f}ms {:6.2f}MB'.format(
+        n, t0 * 1e3, m0 / 2**20, t1 * 1e3, m1 / 2**20))
+
+
+def train(update, steps):
+    np.random.seed(1)
+    params = init(64)
+    start = time.perf_counter()
+    for _ in range(steps):
+        value = update(params)
+    return float(value.data), time.perf_counter() - start
+
+
+def sgd(params, lr=0.5):
+    y = loss(*params)
+    for p in params:
+        p.cleargrad()
+    y.backward()
+    for p in params:
+        p.data -= lr * p.grad.data
+    return y
+
+
+optimizer = NewtonCG(cg_iters=20, damping=1e-3)
+print('NewtonCG  20 steps: loss={:.3e}  {:.2f}s'.format(
+    *train(lambda params: optimizer.update(loss, params), 20)))
+print('GD       500 steps: loss={:.3e}  {:.2f}s'.format(*train(sgd, 500)))
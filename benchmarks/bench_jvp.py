@@ -0,0 +1,74 @@
+# 前向模式(jvp)与反向模式求方向导数和雅可比矩阵的时间
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+np.random.seed(0)
+W = Variable(np.random.randn(256, 256) * 0.05)
+
+
+def loss(x):
+    return F.sum(F.tanh(F.matmul(F.tanh(F.matmul(x, W)), W)) ** 2)
+
+
+def curve(a, b):
+    # 输入2个、输出n个的函数
+    return F.sin(a * grid) * F.exp(-b * grid)
+
+
+def timeit(fn, iters):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    return (time.perf_counter() - start) / iters
+
+
+# 1. 线搜索中的方向导数 d/dt loss(x + t*v)
+x = np.random.randn(64, 256)
+v = np.random.randn(64, 256)
+
+
+def by_jvp():
+    return dezero.jvp(loss, [x], [v])[1].data
+
+
+def by_backward():
+    xv = Variable(x)
+    loss(xv).backward()
+    return (xv.grad.data * v).sum()
+
+
+assert np.allclose(by_jvp(), by_backward())
+print('directional derivative  jvp={:.3f}ms  backward={:.3f}ms'.format(
+    timeit(by_jvp, 200) * 1e3, timeit(by_backward, 200) * 1e3))
+
+# 2. R^2 -> R^n的雅可比矩阵：前向模式2次，反向模式n次
+for n in (10, 100, 1000):
+    grid = np.linspace(0, 1, n)
+    a, b = np.array([3.0]), np.array([0.5])
+
+    def jac_jvp():
+        return np.stack([dezero.jvp(curve, [a, b], [ta, tb])[1].data
+                         for ta, tb in (([1.], [0.]), ([0.], [1.]))], axis=1)
+
+    def jac_backward():
+        rows = []
+        for i in range(n):
+            av, bv = Variable(a), Variable(b)
+            y = curve(av, bv)
+            y.grad = Variable(np.eye(n)[i])
+            y.backward()
+            rows.append([av.grad.data[0], bv.grad.data[0]])
+        return np.array(rows)
+
+    assert np.allclose(jac_jvp(), jac_backward())
+    iters = max(1, 1000 // n)
+    print('jacobian n={:5d}  jvp={:8.3f}ms  backward={:8.3f}ms'.format(
+        n, timeit(jac_jvp, iters) * 1e3, timeit(jac_backward, iters) * 1e3))
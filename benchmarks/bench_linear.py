@@ -0,0 +1,35 @@
+# matmul(x, W) + b 与融合后的linear(x, W, b)的前向+反向时间
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import numpy as np
+from dezero import Variable
+import dezero.functions as F
+
+
+def unfused(x, W, b):
+    return F.matmul(x, W) + b
+
+
+def measure(layer, x, W, b, iters):
+    start = time.perf_counter()
+    for _ in range(iters):
+        x.cleargrad()
+        W.cleargrad()
+        b.cleargrad()
+        y = F.sum(layer(x, W, b))
+        y.backward()
+    return (time.perf_counter() - start) / iters
+
+
+for batch, n_in, n_out, iters in ((100, 1, 1, 5000), (32, 64, 64, 5000), (256, 512, 512, 100)):
+    np.random.seed(0)
+    x = Variable(np.random.rand(batch, n_in))
+    W = Variable(np.random.rand(n_in, n_out))
+    b = Variable(np.zeros(n_out))
+    line = 'batch={:4d} in={:4d} out={:4d}'.format(batch, n_in, n_out)
+    for layer in (unfused, F.linear_simple, F.linear):
+        line += '  {}={:8.1f}us'.format(layer.__name__, measure(layer, x, W, b, iters) * 1e6)
+    print(line)
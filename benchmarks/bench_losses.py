@@ -0,0 +1,53 @@
+# 用小的函数组合出的softmax交叉熵与融合后的softmax_cross_entropy：时间、节点数和峰值内存
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import tracemalloc
+import numpy as np
+from dezero import Variable
+import dezero.functions as F
+
+
+def composed(x, t):
+    # 需要one-hot的目标数组
+    N, CLS_NUM = x.shape
+    onehot = np.eye(CLS_NUM)[t]
+    p = F.exp(x) / F.sum(F.exp(x), axis=1, keepdims=True)
+    return -F.sum(F.log(p) * onehot) / N
+
+
+def count_nodes(y):
+    funcs, stack = set(), [y.creator]
+    while stack:
+        f = stack.pop()
+        if f is not None and f not in funcs:
+            funcs.add(f)
+            stack.extend(x.creator for x in f.inputs)
+    return len(funcs)
+
+
+def measure(loss, x, t, iters):
+    nodes = count_nodes(loss(x, t))
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(iters):
+        x.cleargrad()
+        loss(x, t).backward()
+    elapsed = (time.perf_counter() - start) / iters
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, nodes, peak
+
+
+for N, CLS_NUM, iters in ((32, 10, 2000), (256, 1000, 50), (512, 10000, 5)):
+    np.random.seed(0)
+    x = Variable(np.random.randn(N, CLS_NUM))
+    t = np.random.randint(0, CLS_NUM, N)
+    line = 'N={:4d} classes={:6d}'.format(N, CLS_NUM)
+    for loss in (composed, F.softmax_cross_entropy):
+        elapsed, nodes, peak = measure(loss, x, t, iters)
+        line += '  {}: {:9.1f}us {:2d} nodes {:7.1f}MB'.format(
+            loss.__name__, elapsed * 1e6, nodes, peak / 2**20)
+    print(line)
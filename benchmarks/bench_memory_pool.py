@@ -0,0 +1,55 @@
+# 相同形状的训练迭代中，使用内存池复用数组前后每步的时间，以及池的命中率
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import numpy as np
+try:
+    import resource  # 只用于统计缺页次数，Windows上没有
+except ImportError:
+    resource = None
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+
+def step(x, W, b, t):
+    y = F.tanh(F.matmul(x, W) + b)
+    y = y * F.sin(x) - F.cos(x) / 2
+    loss = F.mean_squared_error(y, t)
+    W.cleargrad()
+    b.cleargrad()
+    loss.backward()
+    W.data -= 0.01 * W.grad.data
+    b.data -= 0.01 * b.grad.data
+
+
+def page_faults():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_minflt if resource else 0
+
+
+def measure(size, iters):
+    np.random.seed(0)
+    x = Variable(np.random.rand(size, size))
+    W = Variable(np.random.rand(size, size) / size)
+    b = Variable(np.zeros(size))
+    t = np.random.rand(size, size)
+    step(x, W, b, t)  # 预热
+    faults = page_faults()
+    start = time.perf_counter()
+    for _ in range(iters):
+        step(x, W, b, t)
+    elapsed = time.perf_counter() - start
+    return elapsed / iters, (page_faults() - faults) // iters
+
+
+for size, iters in ((128, 200), (512, 40), (1024, 10), (2048, 4)):
+    t0, f0 = measure(size, iters)
+    with dezero.memory_pool() as pool:
+        t1, f1 = measure(size, iters)
+    stats = pool.stats()
+    print('size={:5d}  plain={:8.2f}ms ({:6d} faults)  pool={:8.2f}ms ({:6d} faults)  '
+          'hit_rate={:.2f}  saved={:.1f}MB/step'.format(
+              size, t0 * 1e3, f0, t1 * 1e3, f1, stats['hit_rate'],
+              stats['bytes_saved'] / (iters + 1) / 2**20))
@@ -0,0 +1,32 @@
+# no_grad下小数组运算的吞吐量（每秒运算次数）
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+
+def ops_per_sec(fn, n=20000):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return n / (time.perf_counter() - start)
+
+
+for size in (1, 100, 10000):
+    x = Variable(np.random.randn(size))
+    y = Variable(np.random.randn(size))
+    cases = [
+        ('x + y', lambda: x + y),
+        ('x * 2', lambda: x * 2),
+        ('sin(x)', lambda: F.sin(x)),
+        ('numpy x + y', lambda: x.data + y.data),
+    ]
+    print('size={}'.format(size))
+    for name, fn in cases:
+        with dezero.no_grad():
+            print('  {:<12} {:>12,.0f} ops/s'.format(name, ops_per_sec(fn)))
@@ -0,0 +1,35 @@
+# 标量运算构成的计算图：每个节点占用的内存和构建时间
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import tracemalloc
+import numpy as np
+from dezero import Variable
+
+
+def build(x, n):
+    y = x
+    for _ in range(n):
+        y = y * x - y  # 每次循环产生两个函数节点和两个变量
+    return y
+
+
+n = 50000
+x = Variable(np.array(1.0))
+
+tracemalloc.start()
+y = build(x, n)
+size = tracemalloc.get_traced_memory()[0]
+tracemalloc.stop()
+del y
+
+start = time.perf_counter()
+for _ in range(5):
+    y = build(x, n)
+    del y
+elapsed = (time.perf_counter() - start) / 5
+
+print('memory per node : {:.1f} bytes'.format(size / (2 * n)))
+print('build time/node : {:.3f} us'.format(elapsed / (2 * n) * 1e6))
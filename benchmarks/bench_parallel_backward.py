@@ -0,0 +1,47 @@
+# 宽计算图（多个互不依赖的分支）上串行反向传播与线程池并行反向传播的比较
+# BLAS自身的多线程会和线程池抢核心，比较时可以设置OPENBLAS_NUM_THREADS=1
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dezero import Variable
+import dezero.functions as F
+
+
+def wide(x, Ws, depth):
+    # 每个分支：depth层 tanh(matmul(h, W))，最后把所有分支的和相加
+    loss = 0
+    for W in Ws:
+        h = x
+        for _ in range(depth):
+            h = F.tanh(F.matmul(h, W))
+        loss = loss + F.sum(h)
+    return loss
+
+
+def measure(width, size, depth=4, executor=None, repeat=3):
+    np.random.seed(0)
+    x = Variable(np.random.rand(size, size))
+    Ws = [Variable(np.random.rand(size, size) / size) for _ in range(width)]
+    best = float('inf')
+    for _ in range(repeat):
+        loss = wide(x, Ws, depth)
+        x.cleargrad()
+        for W in Ws:
+            W.cleargrad()
+        start = time.perf_counter()
+        loss.backward(executor=executor)
+        best = min(best, time.perf_counter() - start)
+    return best, x.grad.data
+
+
+with ThreadPoolExecutor(4) as executor:
+    for width, size in ((4, 256), (8, 256), (4, 512), (8, 512), (16, 64)):
+        t0, g0 = measure(width, size)
+        t1, g1 = measure(width, size, executor=executor)
+        assert np.allclose(g0, g1)
+        print('width={:3d} size={:4d}  serial={:.4f}s  parallel={:.4f}s  speedup={:.2f}x'.format(
+            width, size, t0, t1, t0 / t1))
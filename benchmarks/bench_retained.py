@@ -0,0 +1,48 @@
+# 只依赖形状的函数（Add、Sub、Sum、BroadcastTo）构成的计算图：前向结束后计算图保留的内存
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import tracemalloc
+import numpy as np
+from dezero import Variable
+from dezero.core import Add, Sub
+import dezero.functions as F
+
+OPS = (Add, Sub, F.Sum, F.BroadcastTo)
+
+
+def loss_fn(x, b, depth):
+    h = x
+    for _ in range(depth):
+        h = (h + b) - b
+    h = F.broadcast_to(F.sum(h, axis=0, keepdims=True), h.shape)
+    return F.sum(h)
+
+
+def measure(retains_inputs, size=1000, depth=5):
+    saved = [op.retains_inputs for op in OPS]
+    for op in OPS:
+        op.retains_inputs = retains_inputs
+    np.random.seed(0)
+    x = Variable(np.random.randn(size, size))
+    b = Variable(np.random.randn(size, size))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    loss = loss_fn(x, b, depth)
+    retained = tracemalloc.get_traced_memory()[0]  # 前向结束、loss还存活时计算图占用的内存
+    loss.backward()
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    for op, flag in zip(OPS, saved):
+        op.retains_inputs = flag
+    return elapsed, retained, x.grad.data, b.grad.data
+
+
+t0, kept0, gx0, gb0 = measure(retains_inputs=True)
+t1, kept1, gx1, gb1 = measure(retains_inputs=False)
+assert np.allclose(gx0, gx1) and np.allclose(gb0, gb1)
+print('retains_inputs=True : retained={:.2f}MB  {:.3f}s'.format(kept0 / 2**20, t0))
+print('retains_inputs=False: retained={:.2f}MB  {:.3f}s'.format(kept1 / 2**20, t1))
@@ -0,0 +1,41 @@
+# 标量计算图在Python的float上执行与在0维ndarray上执行的对比（rosenbrock的梯度下降，每秒迭代次数）
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import numpy as np
+from dezero import Variable, trace
+
+
+def rosenbrock(x0, x1):
+    y = 100 * (x1 - x0 ** 2) ** 2 + (x0 - 1) ** 2
+    return y
+
+
+def run(fn, iters=20000, lr=0.001):
+    x0 = Variable(np.array(0.0))
+    x1 = Variable(np.array(2.0))
+    start = time.perf_counter()
+    for _ in range(iters):
+        y = fn(x0, x1)
+        x0.cleargrad()
+        x1.cleargrad()
+        y.backward()
+        x0.data = x0.data - lr * x0.grad.data
+        x1.data = x1.data - lr * x1.grad.data
+    elapsed = time.perf_counter() - start
+    return iters / elapsed, x0.data, x1.data
+
+
+cases = [
+    ('eager', rosenbrock),
+    ('trace(scalar=False)', trace(rosenbrock, scalar=False)),
+    ('trace', trace(rosenbrock)),
+]
+base = None
+for name, fn in cases:
+    speed, x0, x1 = run(fn)
+    base = base or speed
+    print('{:<20} {:8.0f} iters/s  x0={:.6f} x1={:.6f}  speedup={:.2f}x'.format(
+        name, speed, x0, x1, speed / base))
@@ -0,0 +1,66 @@
+# 负载生成：多个客户端线程逐个发送单样本请求，比较直接执行和合并成批次后执行的吞吐量
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import asyncio
+import threading
+import numpy as np
+import dezero
+from dezero import Variable
+from dezero.serving import BatchingServer
+import dezero.functions as F
+
+np.random.seed(0)
+W1 = Variable(np.random.rand(256, 512) * 0.01)
+W2 = Variable(np.random.rand(512, 10) * 0.01)
+
+
+def model(x):
+    y = F.tanh(F.matmul(x, W1))
+    return F.matmul(y, W2)
+
+
+def load(predict, n_clients, n_requests):
+    samples = np.random.rand(n_clients, 256)
+
+    def client(i):
+        for _ in range(n_requests):
+            predict(samples[i])
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(n_clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return n_clients * n_requests / (time.perf_counter() - start)
+
+
+def unbatched(x):
+    with dezero.no_grad():
+        return model(Variable(x[None])).data[0]
+
+
+n_clients, n_requests = 32, 200
+print('unbatched    {:8.0f} req/s'.format(load(unbatched, n_clients, n_requests)))
+for max_latency in (0.001, 0.005):
+    with BatchingServer(model, max_batch_size=32, max_latency=max_latency) as server:
+        rps = load(server.predict, n_clients, n_requests)
+        m = server.metrics()
+    print('batched({:.0f}ms) {:8.0f} req/s  batch={:.1f}  p50={:.2f}ms p90={:.2f}ms p99={:.2f}ms'
+          .format(max_latency * 1e3, rps, m['mean_batch_size'],
+                  m['p50'] * 1e3, m['p90'] * 1e3, m['p99'] * 1e3))
+
+
+async def main(server, n):
+    xs = np.random.rand(n, 256)
+    ys = await asyncio.gather(*[server.predict_async(x) for x in xs])
+    with dezero.no_grad():
+        assert np.allclose(np.stack(ys), model(Variable(xs)).data)
+
+
+with BatchingServer(model) as server:
+    asyncio.run(main(server, 100))
+print('asyncio: ok')
@@ -0,0 +1,46 @@
+# tanh的n阶导数：每次求导前是否用simplify化简计算图，节点数和时间的比较
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+
+def count_nodes(y):
+    funcs, stack = set(), [y.creator]
+    while stack:
+        f = stack.pop()
+        if f is not None and f not in funcs:
+            funcs.add(f)
+            stack.extend(x.creator for x in f.inputs)
+    return len(funcs)
+
+
+def nth_derivatives(n, simplify):
+    x = Variable(np.array(1.0))
+    y = F.tanh(x)
+    y.backward(create_graph=True)
+    results = []
+    start = time.perf_counter()
+    for i in range(2, n + 1):
+        gx = x.grad
+        if simplify:
+            gx = dezero.simplify(gx, wrt=x)
+        x.cleargrad()
+        gx.backward(create_graph=True)
+        results.append((i, float(x.grad.data), count_nodes(x.grad),
+                        time.perf_counter() - start))
+    return results
+
+
+n = 8
+plain = nth_derivatives(n, False)
+simplified = nth_derivatives(n, True)
+print('order      value     nodes(plain/simplified)      time(plain/simplified)')
+for (i, v0, n0, t0), (_, v1, n1, t1) in zip(plain, simplified):
+    assert np.isclose(v0, v1)
+    print('{:5d} {:12.4f} {:10d} {:10d} {:14.3f}s {:10.3f}s'.format(i, v0, n0, n1, t0, t1))
@@ -0,0 +1,78 @@
+# 多线程同时进行训练和推理：检查各线程的配置互不影响，并测量多线程推理的吞吐量
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+
+def train_worker(n, errors):
+    # 训练线程：每个输出都必须连到计算图上
+    x = Variable(np.random.rand(4, 4))
+    for _ in range(n):
+        y = F.sin(x) * 2 + 1
+        if y.creator is None:
+            errors.append('train: graph not recorded')
+        y = F.sum(y)
+        y.backward()
+        x.cleargrad()
+
+
+def infer_worker(n, errors):
+    # 推理线程：no_grad内的输出不能有creator
+    x = Variable(np.random.rand(4, 4))
+    for _ in range(n):
+        with dezero.no_grad():
+            y = F.sin(x) * 2 + 1
+            if y.creator is not None:
+                errors.append('infer: graph recorded under no_grad')
+        # 离开no_grad后本线程恢复为记录计算图
+        if not dezero.Config.enable_backprop:
+            errors.append('infer: enable_backprop not restored')
+
+
+def stress(n_threads=8, n=2000):
+    errors = []
+    threads = [threading.Thread(target=train_worker if i % 2 else infer_worker,
+                                args=(n, errors)) for i in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors[:5]
+    assert dezero.Config.enable_backprop
+    print('stress: {} threads x {} iterations, no interference'.format(n_threads, n))
+
+
+def predict(x, W1, W2):
+    with dezero.no_grad():
+        y = F.tanh(F.matmul(x, W1))
+        return F.matmul(y, W2)
+
+
+def throughput(n_threads, n=200, batch=64, hidden=512):
+    W1 = Variable(np.random.rand(hidden, hidden) * 0.01)
+    W2 = Variable(np.random.rand(hidden, 10) * 0.01)
+    x = np.random.rand(batch, hidden)
+    per_thread = n // n_threads
+
+    def run(_):
+        for _ in range(per_thread):
+            predict(x, W1, W2)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(n_threads) as ex:
+        list(ex.map(run, range(n_threads)))
+    elapsed = time.perf_counter() - start
+    return per_thread * n_threads / elapsed
+
+
+stress()
+for n_threads in (1, 2, 4, 8):
+    print('threads={}  {:8.1f} batches/s'.format(n_threads, throughput(n_threads)))
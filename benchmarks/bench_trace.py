@@ -0,0 +1,43 @@
+# 线性回归训练循环：逐次构建计算图 vs dezero.trace记录后重放
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+
+def train(step_fn, iters=1000):
+    np.random.seed(0)
+    x = np.random.rand(100, 1)
+    y = 5 + 2 * x + np.random.rand(100, 1)
+    x, y = Variable(x), Variable(y)
+    W = Variable(np.zeros((1, 1)))
+    b = Variable(np.zeros(1))
+
+    def loss_fn(x, y):
+        y_pred = F.matmul(x, W) + b
+        diff = y - y_pred
+        return F.sum(diff ** 2) / len(diff)
+
+    step = step_fn(loss_fn)
+    lr = 0.1
+    start = time.perf_counter()
+    for i in range(iters):
+        loss = step(x, y)
+        W.cleargrad()
+        b.cleargrad()
+        loss.backward()
+        W.data -= lr * W.grad.data
+        b.data -= lr * b.grad.data
+    return time.perf_counter() - start, float(loss.data)
+
+
+eager_time, eager_loss = train(lambda fn: fn)
+traced_time, traced_loss = train(dezero.trace)
+print('eager : {:.4f}s  loss={:.6f}'.format(eager_time, eager_loss))
+print('traced: {:.4f}s  loss={:.6f}'.format(traced_time, traced_loss))
+print('speedup: {:.2f}x'.format(eager_time / traced_time))
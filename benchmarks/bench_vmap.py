@@ -0,0 +1,49 @@
+# 逐个样本调用backward与per_sample_grad求每个样本的梯度的时间
+if '__file__' in globals():
+    import os, sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+np.random.seed(0)
+W1 = Variable(np.random.randn(32, 64) * 0.1)
+b1 = Variable(np.zeros(64))
+W2 = Variable(np.random.randn(64, 1) * 0.1)
+b2 = Variable(np.zeros(1))
+params = [W1, b1, W2, b2]
+
+
+def loss(x, t):
+    y = F.linear(F.tanh(F.linear(x, W1, b1)), W2, b2)
+    return F.mean_squared_error(y, t)
+
+
+def loop(X, T):
+    grads = [[] for _ in params]
+    for x, t in zip(X, T):
+        for p in params:
+            p.cleargrad()
+        loss(Variable(x[None]), t[None]).backward()
+        for g, p in zip(grads, params):
+            g.append(p.grad.data)
+    return [np.stack(g) for g in grads]
+
+
+mapped = dezero.vmap(loss)
+for B in (16, 128, 1024):
+    X = np.random.randn(B, 1, 32)
+    T = np.random.randn(B, 1, 1)
+    start = time.perf_counter()
+    g0 = loop(X[:, 0], T[:, 0])
+    t0 = time.perf_counter() - start
+    dezero.per_sample_grad(mapped, params, X, T)  # 记录计算图
+    start = time.perf_counter()
+    g1 = dezero.per_sample_grad(mapped, params, X, T)
+    t1 = time.perf_counter() - start
+    assert all(np.allclose(a, b) for a, b in zip(g0, g1))
+    print('B={:5d}  loop={:8.2f}ms  per_sample_grad={:7.2f}ms  speedup={:6.1f}x'.format(
+        B, t0 * 1e3, t1 * 1e3, t0 / t1))
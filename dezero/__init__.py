@@ -9,10 +9,17 @@ if is_simple_core:
 
 else:
     from dezero.core import Variable, Function, as_variable, as_array, as_variable
-    from dezero.core import using_config, no_grad
+    from dezero.core import using_config, no_grad, mixed_precision, memory_pool
+    from dezero.core import jvp, hvp
     from dezero.core import Config
     from dezero.core import setup_variable
     
     import dezero.functions
+    from dezero.functions import checkpoint, checkpoint_sequential
+    from dezero.tracing import trace
+    from dezero.profiler import profile
+    from dezero.memory import MemoryPool
+    from dezero.batching import vmap, per_sample_grad
+    from dezero.simplify import simplify
 
 setup_variable()
\ No newline at end of file
@@ -0,0 +1,300 @@
+import copy
+import numpy as np
+import dezero.functions as F
+from dezero.core import Function, Variable, Config, as_variable, as_array
+from dezero.core import Add, Sub, Mul, Div, Neg, Pow
+from dezero.core import AddConstant, SubConstant, RSubConstant, MulConstant
+from dezero.core import DivConstant, RDivConstant
+from dezero.functions import Sin, Cos, Tanh, Exp, Log, Sigmoid, Softmax
+from dezero.functions import Reshape, Transpose, Sum, BroadcastTo, SumTo
+from dezero.functions import MatMul, Linear, MeanSquaredError
+from dezero.tracing import Program
+
+
+# =============================================================================
+# 批量规则：在带有批次轴（第0轴）的变量上执行单个样本的运算
+# =============================================================================
+class BatchMatMul(Function):
+    __slots__ = ()
+    retains_inputs = False
+
+    def forward(self, x, W):
+        # x: (B, n, k), W: (B, k, m)
+        self.save_for_backward(x, W)
+        return np.matmul(x, W)
+
+    def backward(self, gy):
+        x, W = self.saved_variables
+        gx = batch_matmul(gy, F.transpose(W, (0, 2, 1)))
+        gW = batch_matmul(F.transpose(x, (0, 2, 1)), gy)
+        return gx, gW
+
+    def backward_array(self, gy):
+        x, W = self.saved_tensors
+        return np.matmul(gy, W.swapaxes(1, 2)), np.matmul(x.swapaxes(1, 2), gy)
+
+    def jvp(self, tx, tW):
+        x, W = self.saved_tensors
+        return np.matmul(tx, W) + np.matmul(x, tW)
+
+def batch_matmul(x, W):
+    return BatchMatMul()(x, W)
+
+
+class Looped(Function):
+    __slots__ = ('f', 'batched', 'copies')
+
+    def __init__(self, f, batched):
+        # 没有批量规则的函数：对每个样本分别执行f的一个副本
+        self.f = f
+        self.batched = batched
+
+    def forward(self, *xs):
+        B = next(len(x) for x, b in zip(xs, self.batched) if b)
+        self.copies = []
+        ys = []
+        for i in range(B):
+            g = copy.copy(self.f)
+            g.saved_tensors = None
+            y = g.forward(*[x[i] if b else x for x, b in zip(xs, self.batched)])
+            self.copies.append(g)
+            ys.append(y if isinstance(y, tuple) else (y,))
+        ys = tuple(np.stack([as_array(y[k]) for y in ys]) for k in range(len(ys[0])))
+        return ys[0] if len(ys) == 1 else ys
+
+    def backward_array(self, *gys):
+        gxs = None
+        for i, g in enumerate(self.copies):
+            gx = g.backward_array(*[None if gy is None else gy[i] for gy in gys])
+            gx = gx if isinstance(gx, tuple) else (gx,)
+            if gxs is None:
+                gxs = [[] if b else None for b in self.batched]
+            for k, (b, gxk) in enumerate(zip(self.batched, gx)):
+                if b:
+                    gxs[k].append(gxk)
+                elif gxk is not None:
+                    gxs[k] = gxk if gxs[k] is None else gxs[k] + gxk
+        # 对标签等不需要求导的输入，每个样本的梯度都是None
+        return tuple((None if gx[0] is None else np.stack(gx)) if b else gx
+                     for gx, b in zip(gxs, self.batched))
+
+    def jvp(self, *tangents):
+        tys = []
+        for i, g in enumerate(self.copies):
+            ty = g.jvp(*[t[i] if b else t for t, b in zip(tangents, self.batched)])
+            tys.append(ty if isinstance(ty, tuple) else (ty,))
+        tys = tuple(np.stack([as_array(ty[k]) for ty in tys]) for k in range(len(tys[0])))
+        return tys[0] if len(tys) == 1 else tys
+
+    def backward(self, *gys):
+        # 与TracedGraph相同，得到的梯度不能再继续求导，也不带切向量
+        if Config.enable_backprop:
+            raise NotImplementedError('{} has no batching rule and does not support '
+                                      'create_graph under vmap'.format(type(self.f).__name__))
+        if Config.tangents is not None:
+            raise NotImplementedError('{} has no batching rule and does not support hvp '
+                                      'under vmap'.format(type(self.f).__name__))
+        gxs = self.backward_array(*[None if gy is None else gy.data for gy in gys])
+        return tuple(None if gx is None else Variable(as_array(gx)) for gx in gxs)
+
+
+def _sample_ndim(x, b):
+    return x.ndim - 1 if b else x.ndim
+
+def _expand(x, ndim):
+    # 在批次轴后插入大小为1的轴，使样本的维数变为ndim，之后按NumPy的规则广播
+    r = x.ndim - 1
+    if r < ndim:
+        x = F.reshape(x, (x.shape[0],) + (1,) * (ndim - r) + x.shape[1:])
+    return x
+
+def _shift_axis(axis, ndim):
+    # 样本上的轴 -> 带批次轴的变量上的轴
+    if axis is None:
+        return tuple(range(1, ndim + 1))
+    if isinstance(axis, tuple):
+        return tuple(a % ndim + 1 for a in axis)
+    return axis % ndim + 1
+
+def _elementwise(op):
+    def rule(f, xs, bs, B):
+        ndim = max(_sample_ndim(x, b) for x, b in zip(xs, bs))
+        xs = [_expand(x, ndim) if b else x for x, b in zip(xs, bs)]
+        return op(f, *xs)
+    return rule
+
+def _matmul(f, xs, bs, B):
+    x, W = xs
+    bx, bW = bs
+    if not bW:
+        # 批次轴合并到x的行上，仍然是一次二维的矩阵乘法
+        k = W.shape[0]
+        y = F.matmul(F.reshape(x, (-1, k)), W)
+        return F.reshape(y, x.shape[:-1] + (W.shape[1],))
+    if not bx:
+        x = F.broadcast_to(x, (B,) + x.shape)
+    if x.ndim == 2:  # 样本是向量
+        y = batch_matmul(F.reshape(x, (B, 1, x.shape[1])), W)
+        return F.reshape(y, (B, W.shape[2]))
+    return batch_matmul(x, W)
+
+def _linear(f, xs, bs, B):
+    y = _matmul(f, xs[:2], bs[:2], B)
+    if len(xs) == 2:
+        return y
+    return _elementwise(lambda f, y, b: y + b)(f, [y, xs[2]], [True, bs[2]], B)
+
+def _sum(f, xs, bs, B):
+    x, = xs
+    axis = _shift_axis(f.axis, x.ndim - 1)
+    return F.sum(x, axis, f.keepdims)
+
+def _reshape(f, xs, bs, B):
+    shape = f.shape if isinstance(f.shape, (tuple, list)) else (f.shape,)
+    return F.reshape(xs[0], (B,) + tuple(shape))
+
+def _transpose(f, xs, bs, B):
+    x, = xs
+    ndim = x.ndim - 1
+    if f.axes is None:
+        axes = tuple(range(ndim, 0, -1))
+    else:
+        axes = tuple(a % ndim + 1 for a in f.axes)
+    return F.transpose(x, (0,) + axes)
+
+def _broadcast_to(f, xs, bs, B):
+    x = _expand(xs[0], len(f.shape))
+    return F.broadcast_to(x, (B,) + tuple(f.shape))
+
+def _sum_to(f, xs, bs, B):
+    x, = xs
+    lead = x.ndim - 1 - len(f.shape)
+    if lead > 0:
+        # utils.sum_to会把多出来的前导轴都加起来，批次轴必须保留
+        x = F.sum(x, tuple(range(1, lead + 1)))
+    return F.sum_to(x, (B,) + tuple(f.shape))
+
+def _softmax(f, xs, bs, B):
+    x, = xs
+    return F.softmax(x, _shift_axis(f.axis, x.ndim - 1))
+
+def _mean_squared_error(f, xs, bs, B):
+    diff = _elementwise(lambda f, x0, x1: x0 - x1)(f, xs, bs, B)
+    if f.reduction == 'none':
+        return diff * diff
+    y = F.sum(diff * diff, tuple(range(1, diff.ndim)))
+    if f.reduction == 'mean':
+        y = y / diff.shape[1]
+    return y
+
+_RULES = {
+    Add: _elementwise(lambda f, x0, x1: x0 + x1),
+    Sub: _elementwise(lambda f, x0, x1: x0 - x1),
+    Mul: _elementwise(lambda f, x0, x1: x0 * x1),
+    Div: _elementwise(lambda f, x0, x1: x0 / x1),
+    Neg: _elementwise(lambda f, x: -x),
+    Pow: _elementwise(lambda f, x: x ** f.c),
+    AddConstant: _elementwise(lambda f, x: AddConstant(f.c)(x)),
+    SubConstant: _elementwise(lambda f, x: SubConstant(f.c)(x)),
+    RSubConstant: _elementwise(lambda f, x: RSubConstant(f.c)(x)),
+    MulConstant: _elementwise(lambda f, x: MulConstant(f.c)(x)),
+    DivConstant: _elementwise(lambda f, x: DivConstant(f.c)(x)),
+    RDivConstant: _elementwise(lambda f, x: RDivConstant(f.c)(x)),
+    Sin: _elementwise(lambda f, x: F.sin(x)),
+    Cos: _elementwise(lambda f, x: F.cos(x)),
+    Tanh: _elementwise(lambda f, x: F.tanh(x)),
+    Exp: _elementwise(lambda f, x: F.exp(x)),
+    Log: _elementwise(lambda f, x: F.log(x)),
+    Sigmoid: _elementwise(lambda f, x: F.sigmoid(x)),
+    MatMul: _matmul,
+    Linear: _linear,
+    Sum: _sum,
+    Reshape: _reshape,
+    Transpose: _transpose,
+    BroadcastTo: _broadcast_to,
+    SumTo: _sum_to,
+    Softmax: _softmax,
+    MeanSquaredError: _mean_squared_error,
+}
+
+
+# =============================================================================
+# vmap / per_sample_grad
+# =============================================================================
+class VmappedFunction:
+    def __init__(self, fn, in_axes=0):
+        self.fn = fn
+        self.in_axes = in_axes  # 0或None，或者每个参数对应一个0/None的元组
+        self.programs = {}      # 按单个样本的形状和类型缓存记录结果
+
+    def _axes(self, n):
+        if isinstance(self.in_axes, (tuple, list)):
+            return tuple(self.in_axes)
+        return (self.in_axes,) * n
+
+    def __call__(self, *inputs):
+        return self.apply(inputs)
+
+    def apply(self, inputs, substitutes=None):
+        # substitutes: id(外部变量) -> 带批次轴的变量，用于把参数替换成每个样本一份的副本
+        inputs = [as_variable(x) for x in inputs]
+        axes = self._axes(len(inputs))
+        B = next(len(x) for x, a in zip(inputs, axes) if a is not None)
+        samples = [Variable(as_array(x.data[0])) if a is not None else x
+                   for x, a in zip(inputs, axes)]
+        key = tuple((x.shape, x.dtype) for x in samples) + (axes,)
+        program = self.programs.get(key)
+        if program is None:
+            # 在一个样本上记录计算图，之后按批量规则重放
+            program = self.programs[key] = Program.record(self.fn, samples)
+
+        values = inputs + [None] * (program.n_slots - len(inputs))
+        batched = [a is not None for a in axes] + [False] * (program.n_slots - len(inputs))
+        for k, leaf in enumerate(program.leaves):
+            slot = program.n_inputs + k
+            if substitutes is not None and id(leaf) in substitutes:
+                values[slot] = substitutes[id(leaf)]
+                batched[slot] = True
+            else:
+                values[slot] = leaf
+
+        for f, ins, outs in program.ops:
+            xs = [values[i] for i in ins]
+            bs = [batched[i] for i in ins]
+            if not any(bs):
+                ys = copy.copy(f)(*xs)
+            elif type(f) in _RULES:
+                ys = _RULES[type(f)](f, xs, bs, B)
+            else:
+                ys = Looped(f, bs)(*xs)
+            ys = ys if isinstance(ys, (tuple, list)) else (ys,)
+            for o, y in zip(outs, ys):
+                values[o] = y
+                batched[o] = any(bs)
+
+        ys = []
+        for o in program.outputs:
+            y = values[o]
+            if not batched[o]:  # 不依赖于被映射的输入的输出，每个样本都相同
+                y = F.broadcast_to(y, (B,) + y.shape)
+            ys.append(y)
+        return ys[0] if len(ys) == 1 else tuple(ys)
+
+
+def vmap(fn, in_axes=0):
+    # fn按单个样本编写，返回的函数接收第0轴为批次的输入，输出的第0轴也是批次
+    # 结果是普通的Variable，可以直接调用backward()
+    return VmappedFunction(fn, in_axes)
+
+
+def per_sample_grad(fn, params, *inputs, in_axes=0):
+    # fn对单个样本返回标量损失，params是fn中用到的参数（例如W、b）
+    # 返回每个参数的梯度，形状为(B,) + 参数的形状
+    mapped = fn if isinstance(fn, VmappedFunction) else VmappedFunction(fn, in_axes)
+    axes = mapped._axes(len(inputs))
+    B = next(len(as_variable(x)) for x, a in zip(inputs, axes) if a is not None)
+    copies = [Variable(np.broadcast_to(p.data, (B,) + p.shape)) for p in params]
+    loss = mapped.apply(inputs, {id(p): c for p, c in zip(params, copies)})
+    F.sum(loss).backward()
+    return [np.zeros((B,) + p.shape, p.dtype) if c.grad is None else c.grad.data
+            for p, c in zip(params, copies)]
@@ -1,20 +1,69 @@
+import math
 import numpy as np
+import heapq
+import itertools
 import weakref
 import contextlib
+import contextvars
+import threading
 import dezero
+from dezero import utils
+from dezero.memory import MemoryPool
 
 def as_variable(obj):
     if isinstance(obj, Variable):
         return obj
-    if isinstance(obj, (int, float)):  # obj是标量
-        obj = np.array(obj)
-    return Variable(obj)
+    return Variable(as_array(obj))
 
-def as_array(x):
-    if np.isscalar(x):
+def as_array(x, dtype=None):
+    if isinstance(x, np.ndarray):  # 最常见的情况放在最前面，np.isscalar比较慢
+        return x
+    if isinstance(x, np.generic):  # NumPy的标量保持原来的类型
         return np.array(x)
+    if np.isscalar(x):             # Python的标量按照Config.dtype转换
+        return np.array(x, dtype=Config.dtype if dtype is None else dtype)
     return x
 
+def as_operand(x0, x1):
+    # 与x0运算的Python标量转换为x0的精度，避免把float32/float16的数据提升为float64
+    if isinstance(x1, (Variable, np.ndarray)):
+        return x1
+    if np.isscalar(x1) and not isinstance(x1, np.generic):
+        return as_constant(x0, x1)
+    return as_array(x1)
+
+_constants = {}  # (标量的类型, 值, x的类型) -> 只读的0维数组
+
+def as_constant(x, c):
+    # 与x运算的Python标量按x的精度转换为0维数组，同样的值只创建一次。
+    # 数组是只读的，被多个函数共用也不会被原地修改
+    key = (type(c), c, x.data.dtype)
+    if c == 0 and type(c) is float:
+        key += (math.copysign(1.0, c),)  # 0.0 == -0.0，但除以它们的结果符号不同
+    a = _constants.get(key)
+    if a is None:
+        a = np.array(c, dtype=np.result_type(x.data, c))
+        a.flags.writeable = False
+        # 学习率等不断变化的值不会让缓存无限增长；NaN与自身不相等，缓存了也查不到
+        if len(_constants) < 1024 and c == c:
+            _constants[key] = a
+    return a
+
+def is_literal(x):
+    # np.float64是float的子类，NumPy的标量仍然按照原来的类型作为输入
+    return type(x) is float or type(x) is int
+
+def apply_ufunc(ufunc, *args, dtype=None):
+    # 启用内存池时，计算结果写入从池中取出的缓冲区
+    pool = Config.memory_pool
+    if pool is None:
+        return ufunc(*args) if dtype is None else ufunc(*args, dtype=dtype)
+    result_type = np.result_type(*args) if dtype is None else np.dtype(dtype)
+    if result_type.kind != 'f':
+        return ufunc(*args) if dtype is None else ufunc(*args, dtype=dtype)
+    out = pool.empty(np.broadcast_shapes(*[np.shape(a) for a in args]), result_type)
+    return ufunc(*args, out=out, dtype=dtype)
+
 @contextlib.contextmanager
 def using_config(name, value):
     old_value = getattr(Config, name)  # 获取Config的name属性
@@ -28,11 +77,135 @@ def using_config(name, value):
 def no_grad():
     return using_config('enable_backprop', False)
 
+# 数据以dtype保存，梯度以accum_dtype计算和累加
+@contextlib.contextmanager
+def mixed_precision(dtype=np.float16, accum_dtype=np.float32):
+    with using_config('dtype', dtype), using_config('accum_dtype', accum_dtype):
+        yield
 
-class Config:
-    enable_backprop = True  # 默认启用反向传播
+@contextlib.contextmanager
+def memory_pool(pool=None):
+    # with dezero.memory_pool() as pool:
+    #     for i in range(iters): ...
+    # print(pool.stats())
+    if pool is None:
+        pool = MemoryPool()
+    with using_config('memory_pool', pool):
+        yield pool
+
+
+def jvp(fn, primals, tangents):
+    # 前向模式自动微分：一次前向计算同时得到fn的输出和沿tangents方向的方向导数，
+    # 不记录计算图。返回(outputs, output_tangents)
+    primals = [Variable(x.data) if isinstance(x, Variable) else Variable(as_array(x))
+               for x in primals]
+    tangent_map = weakref.WeakKeyDictionary()  # 中间变量被释放时，它的切向量也随之释放
+    for x, t in zip(primals, tangents):
+        t = t.data if isinstance(t, Variable) else t
+        tangent_map[x] = np.asarray(t, dtype=x.dtype)
+    with no_grad(), using_config('tangents', tangent_map):
+        outputs = fn(*primals)
+
+    single = not isinstance(outputs, (tuple, list))
+    outputs = [as_variable(y) for y in ((outputs,) if single else outputs)]
+    output_tangents = []
+    for y in outputs:
+        t = tangent_map.get(y)
+        output_tangents.append(Variable(np.zeros_like(y.data) if t is None else as_array(t)))
+    if single:
+        return outputs[0], output_tangents[0]
+    return tuple(outputs), tuple(output_tangents)
+
+def hvp(f, x, v):
+    # 海森矩阵与向量的积H·v：记录前向的同时传播切向量v，反向传播时用Variable计算梯度，
+    # 梯度的切向量就是H·v（forward-over-reverse）。不记录二阶导数的计算图
+    # x可以是一个变量，也可以是变量的列表（此时v是同样长度的列表，f接收多个参数）
+    single = not isinstance(x, (tuple, list))
+    xs = [x] if single else x
+    vs = [v] if single else v
+    xs = [Variable(x.data) if isinstance(x, Variable) else Variable(as_array(x)) for x in xs]
+    tangent_map = weakref.WeakKeyDictionary()
+    for x, t in zip(xs, vs):
+        t = t.data if isinstance(t, Variable) else t
+        tangent_map[x] = np.asarray(t, dtype=x.dtype)
+    with using_config('tangents', tangent_map):
+        with using_config('enable_backprop', True):
+            y = f(*xs)
+        # f中用到的参数等其他叶子变量的梯度在反向传播后恢复原样，只有xs的副本累加梯度
+        others = [(v, v.grad) for v in _leaves(y) if all(v is not x for x in xs)]
+        y.backward(free_graph=True)
+        for v, grad in others:
+            v.grad = grad
+
+    hvs = []
+    for x in xs:
+        t = None if x.grad is None else tangent_map.get(x.grad)
+        hvs.append(Variable(np.zeros_like(x.data) if t is None else as_array(t)))
+    return hvs[0] if single else hvs
+
+def _leaves(y):
+    leaves, seen, stack = [], set(), [y.creator]
+    while stack:
+        f = stack.pop()
+        if f is None or f in seen:
+            continue
+        seen.add(f)
+        for x in f.inputs:
+            if x.creator is None:
+                if all(x is not v for v in leaves):
+                    leaves.append(x)
+            else:
+                stack.append(x.creator)
+    return leaves
+
+def _push_tangents(f, inputs, outputs, tangent_map):
+    ts = [tangent_map.get(x) if isinstance(x, Variable) else None for x in inputs]
+    if all(t is None for t in ts):
+        return
+    # 没有切向量的输入（常数、参数等）视为0
+    ts = [np.zeros_like(x.data if isinstance(x, Variable) else as_array(x)) if t is None else t
+          for x, t in zip(inputs, ts)]
+    tys = f.jvp(*ts)
+    if not isinstance(tys, tuple):
+        tys = (tys,)
+    for y, ty in zip(outputs, tys):
+        tangent_map[y] = as_array(ty)
+
+
+class _Option:
+    # 每个配置项的值保存在ContextVar中，每个线程（以及asyncio的每个任务）互不影响，
+    # 新线程从默认值开始
+    def __init__(self, default):
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.var = contextvars.ContextVar(name, default=self.default)
+
+    def __get__(self, obj, objtype=None):
+        return self.var.get()
+
+    def __set__(self, obj, value):
+        self.var.set(value)
+
+
+class _Config:
+    enable_backprop = _Option(True)  # 默认启用反向传播
+    dtype = _Option(np.float32)      # 由Python标量创建数组时使用的类型
+    accum_dtype = _Option(None)      # 反向传播中梯度使用的类型，None表示与数据相同
+    memory_pool = _Option(None)      # 不为None时，运算从这个MemoryPool中分配结果数组
+    tangents = _Option(None)         # 前向模式微分时，变量 -> 切向量（ndarray）
+
+Config = _Config()
+
+# 并行反向传播时：id(变量) -> 锁。Checkpoint等在工作线程中再调用backward()时，
+# 对同一个变量（例如共用的参数W）的梯度累加也要和其他工作线程互斥
+_grad_locks = contextvars.ContextVar('grad_locks', default=None)
+_no_lock = contextlib.nullcontext()
 
 class Variable:
+    __slots__ = ('data', 'name', 'grad', 'creator', 'generation', '__weakref__')
+    __array_priority__ = 200  # ndarray的优先级是0，Variable的优先级更高
+
     def __init__(self, data, name=None):
         if data is not None:
             if not isinstance(data, np.ndarray):
@@ -43,7 +216,6 @@ class Variable:
         self.grad = None
         self.creator = None
         self.generation = 0  # 记录该变量是第几代
-        self.__array_priority__ = 200  # ndarray的优先级是0，Variable的优先级更高
 
     def __len__(self):   # len()函数调用
         return len(self.data)
@@ -61,43 +233,85 @@ class Variable:
     def cleargrad(self):
         self.grad = None
 
-    def backward(self, retain_grad=False, create_graph=False):
+    def backward(self, retain_grad=False, create_graph=False, free_graph=False,
+                 executor=None):
         if self.grad is None:
             # self.grad = np.ones_like(self.data)
-            self.grad = Variable(np.ones_like(self.data))
+            self.grad = Variable(np.ones_like(self.data, dtype=Config.accum_dtype))
+
+        if executor is not None:
+            # 在线程池上并行处理互不依赖的分支
+            return _parallel_backward(self, retain_grad, create_graph, free_graph, executor)
 
         funcs = []
         seen_set = set()
+        owned = set()  # 本次反向传播中新分配的梯度，只有它们可以原地累加
+        alive = {}     # free_graph时，保持还没处理的函数的输出存活
 
         def add_func(f):
             if f not in seen_set:
-                funcs.append(f)
+                # 用堆代替每次排序：世代取负数，堆顶就是世代最大的函数
+                # 世代相同时按插入顺序后进先出，与原来排序后pop()的顺序一致
+                heapq.heappush(funcs, (-f.generation, -len(seen_set), f))
                 seen_set.add(f)
-                # 根据世代大小排序，世代小的排在前面
-                funcs.sort(key=lambda x: x.generation)
         
         add_func(self.creator)
-
-        while funcs:
-            f = funcs.pop()    # 1. 取出函数
-            gys = [output().grad for output in f.outputs]  # 2. 获取函数的输出的梯度
-            with using_config('enable_backprop', create_graph):    
-                gxs = f.backward(*gys)                     # 3. 计算输入的梯度
+        # 前向模式的切向量有效时（hvp），也要用Variable计算，使梯度带上切向量
+        use_variable = create_graph or Config.tangents is not None
+        grad_locks = _grad_locks.get()
+
+        with using_config('enable_backprop', create_graph):
+            while funcs:
+                f = heapq.heappop(funcs)[2]    # 1. 取出函数
+                gys = [output().grad for output in f.outputs]  # 2. 获取函数的输出的梯度
+                for gy in gys:
+                    # gy可能被backward原样返回给多个输入，之后不能再原地修改
+                    owned.discard(gy)
+
+                # 3. 计算输入的梯度：需要高阶导数时用Variable计算，否则直接在ndarray上计算
+                if use_variable:
+                    gxs = f.backward(*gys)
+                else:
+                    gxs = f.backward_array(*[None if gy is None else gy.data for gy in gys])
                 if not isinstance(gxs, tuple):             # 如果gxs不是元组，则将其转换为元组
                     gxs = (gxs,)
 
                 for x, gx in zip(f.inputs, gxs):           # 4. 将梯度设置为输入变量
-                    if x.grad is None:
-                        x.grad = gx
-                    else:
-                        x.grad = x.grad + gx  # 累加梯度
+                    if gx is None:  # 不需要求导的输入（例如标签）
+                        continue
+                    lock = _no_lock if grad_locks is None else \
+                        grad_locks.setdefault(id(x), threading.Lock())
+                    with lock:
+                        if use_variable:
+                            x.grad = gx if x.grad is None else x.grad + gx  # 累加梯度
+                        elif x.grad is None:
+                            x.grad = Variable(as_array(gx))
+                        elif x.grad in owned:
+                            x.grad.data += gx  # 不需要高阶导数时原地累加
+                        else:
+                            # 第一次累加时分配一个新的缓冲区，之后都累加到这个缓冲区上
+                            x.grad = Variable(as_array(
+                                apply_ufunc(np.add, x.grad.data, gx, dtype=Config.accum_dtype)))
+                            owned.add(x.grad)
 
                     if x.creator is not None:
                         add_func(x.creator)    # 5. 将函数的输入的创造者添加到列表中
-            
-            if not retain_grad:
-                for y in f.outputs:
-                    y().grad = None  # y是弱引用的对象，必须通过()获取原始对象
+                        if free_graph:
+                            alive.setdefault(x.creator, set()).add(x)
+
+                if not retain_grad:
+                    for y in f.outputs:
+                        y().grad = None  # y是弱引用的对象，必须通过()获取原始对象
+
+                if free_graph:
+                    # 后面处理的函数的世代都更小，不会再用到f，断开f与计算图的连接，
+                    # 使只被计算图引用的中间变量及其数据尽早释放
+                    for y in f.outputs:
+                        y().creator = None
+                    f.inputs = None
+                    f.outputs = None
+                    f.saved_tensors = None
+                    alive.pop(f, None)
 
     def reshape(self, *shape):
         if len(shape) == 1 and isinstance(shape[0], (tuple, list)):
@@ -130,39 +344,291 @@ class Variable:
     def dtype(self):    # 数据类型
         return self.data.dtype
     
+def _parallel_backward(y, retain_grad, create_graph, free_graph, executor):
+    # 先遍历计算图，统计每个函数还要等待多少条边（使用其输出的函数）处理完，
+    # 计数归零的函数提交给executor执行
+    pending = {y.creator: 0}
+    outputs = {}  # 函数 -> 输出，保持输出存活直到函数被处理
+    locks = {}    # id(变量) -> 锁，同一个变量的梯度累加互斥
+    stack = [y.creator]
+    while stack:
+        f = stack.pop()
+        outputs[f] = [output() for output in f.outputs]
+        for x in f.inputs:
+            locks.setdefault(id(x), threading.Lock())
+            g = x.creator
+            if g is not None:
+                if g not in pending:
+                    pending[g] = 0
+                    stack.append(g)
+                pending[g] += 1
+
+    owned = set()
+    counter = threading.Lock()
+    done = threading.Event()
+    remaining = [len(pending)]
+    errors = []
+    use_variable = create_graph or Config.tangents is not None
+
+    # 线程池的线程从空的上下文开始，每个任务都在调用者的配置（dtype、accum_dtype、
+    # memory_pool、tangents等）的副本中执行。同一个Context不能同时在多个线程中进入，
+    # 所以每次提交都复制一份
+    with using_config('enable_backprop', create_graph):
+        token = _grad_locks.set(locks)
+        try:
+            context = contextvars.copy_context()
+        finally:
+            _grad_locks.reset(token)
+
+    def submit(f):
+        executor.submit(context.copy().run, run, f)
+
+    def run(f):
+        try:
+            ys = outputs[f]
+            gys = [y.grad for y in ys]
+            for gy in gys:
+                owned.discard(gy)
+            if all(gy is None for gy in gys):
+                # 梯度没有传到这个函数，只需要通知它的输入的创造者
+                gxs = (None,) * len(f.inputs)
+            elif use_variable:
+                gxs = f.backward(*gys)
+            else:
+                gxs = f.backward_array(*[None if gy is None else gy.data for gy in gys])
+            if not isinstance(gxs, tuple):
+                gxs = (gxs,)
+
+            ready = []
+            for x, gx in zip(f.inputs, gxs):
+                with locks[id(x)]:
+                    if gx is None:
+                        pass
+                    elif use_variable:
+                        x.grad = gx if x.grad is None else x.grad + gx
+                    elif x.grad is None:
+                        x.grad = Variable(as_array(gx))
+                    elif x.grad in owned:
+                        x.grad.data += gx
+                    else:
+                        x.grad = Variable(as_array(
+                            apply_ufunc(np.add, x.grad.data, gx, dtype=Config.accum_dtype)))
+                        owned.add(x.grad)
+                if x.creator is not None:
+                    with counter:
+                        pending[x.creator] -= 1
+                        if pending[x.creator] == 0:
+                            ready.append(x.creator)
+
+            if not retain_grad:
+                for y in ys:
+                    y.grad = None
+            if free_graph:
+                for y in ys:
+                    y.creator = None
+                f.inputs = None
+                f.outputs = None
+                f.saved_tensors = None
+                del outputs[f]
+            for g in ready:
+                submit(g)
+        except BaseException as e:
+            # 包括提交失败（例如executor已经关闭），否则done永远不会被设置
+            errors.append(e)
+            done.set()
+            return
+
+        with counter:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+
+    submit(y.creator)
+    done.wait()
+    if errors:
+        raise errors[0]
+
+
+def _saved_slots(saved, xs, ys):
+    # 保存的每个ndarray来自哪个输入（i）或输出（输入个数 + j），其他的为None
+    slots = []
+    for a in saved:
+        for k, b in enumerate(itertools.chain(xs, ys)):
+            if a is b:
+                slots.append(k)
+                break
+        else:
+            slots.append(None)
+    return tuple(slots)
+
+class _Input(weakref.ref):
+    # 计算图对没有被保存的非叶子输入只持有这个弱引用，调用者丢弃变量后它的数据就能释放。
+    # 它同时替换创造者的outputs中对应的弱引用，同一个变量的所有使用者共用一个。
+    # 变量被回收时换成只有形状的替身变量（不占内存），梯度仍然经由替身传给创造者
+    __slots__ = ('creator', 'index', 'shape', 'dtype', 'standin')
+
+    def __new__(cls, x, creator, index):
+        return super().__new__(cls, x, _Input._release)
+
+    def __init__(self, x, creator, index):
+        super().__init__(x, _Input._release)
+        self.creator = weakref.ref(creator)
+        self.index = index
+        self.shape = x.shape
+        self.dtype = x.dtype
+        self.standin = None
+
+    def __call__(self):
+        x = super().__call__()
+        return self.standin if x is None else x
+
+    @staticmethod
+    def _release(self):
+        # 在变量被回收时调用，此时变量还持有它的创造者。创造者保存了这个输出时，
+        # 替身使用保存的数据（它本来就被保留），backward才能从outputs读到真实的值
+        f = self.creator()
+        data = None
+        if f is not None and f.saved_tensors is not None and f._inputs is not None:
+            k = len(f._inputs) + self.index
+            for a, slot in zip(f.saved_tensors, f.saved_slots):
+                if slot == k:
+                    data = a
+                    break
+        if data is None:
+            data = np.broadcast_to(np.zeros((), self.dtype), self.shape)
+        standin = Variable(data)
+        if f is not None and f.outputs is not None and f.outputs[self.index] is self:
+            standin.set_creator(f)
+            # 创造者只弱引用替身，替身由使用者（经由这个对象）持有，不形成循环引用
+            f.outputs[self.index] = weakref.ref(standin)
+        self.standin = standin
+
+def _weak_input(x):
+    f = x.creator
+    for i, y in enumerate(f.outputs):
+        if y() is x:
+            if type(y) is not _Input:
+                y = f.outputs[i] = _Input(x, f, i)
+            return y
+    return x
+
+_serial = itertools.count()  # 加入计算图的函数的序号，用来判断函数是否在某个时刻之后创建
+
 class Function:
+    # 子类用__slots__声明各自需要的属性，不再为每个实例创建__dict__
+    __slots__ = ('_inputs', 'outputs', 'generation', 'serial', 'saved_tensors', 'saved_slots',
+                 '__weakref__')
+    # 为False的函数，backward只使用save_for_backward保存的数据（和输出的梯度），
+    # 计算图不再持有没有保存的非叶子输入。backward中直接读取self.inputs的数据的函数
+    # （包括没有使用save_for_backward的自定义函数）保持默认的True
+    retains_inputs = True
+
+    @property
+    def inputs(self):
+        inputs = self._inputs
+        if inputs is None:
+            return None
+        return [x() if type(x) is _Input else x for x in inputs]
+
+    @inputs.setter
+    def inputs(self, inputs):
+        self._inputs = inputs
+
     # 在参数前面加*，可以在不使用列表的情况下调用具有任意个参数的函数
     def __call__(self, *inputs):
+        if not Config.enable_backprop:
+            # 推理模式：直接在ndarray上计算，跳过计算图相关的所有处理
+            ys = self.forward(*[x.data if isinstance(x, Variable) else as_array(x)
+                                for x in inputs])
+            if isinstance(ys, tuple):
+                outputs = [Variable(as_array(y)) for y in ys]
+            else:
+                outputs = Variable(as_array(ys))
+            if Config.tangents is not None:
+                _push_tangents(self, inputs, outputs if isinstance(ys, tuple) else [outputs],
+                               Config.tangents)
+            return outputs
+
         inputs = [as_variable(x) for x in inputs]  # 确保inputs中的元素都是Variable类型
 
         xs = [x.data for x in inputs]  # 获取所有输入变量的data属性
+        if len(xs) > 1 and len(set(map(id, xs))) < len(xs):
+            # 同一个ndarray作为多个输入时，重复的换成视图，保存的数据才能对应到确定的输入
+            seen = set()
+            for i, a in enumerate(xs):
+                if id(a) in seen:
+                    xs[i] = a.view()
+                seen.add(id(a))
         
         # 参数前添加*可以解包列表，将其中的元素作为独立的参数传递
+        self.saved_tensors = None
         ys = self.forward(*xs)         # 将所有输入变量的data属性传递
         if not isinstance(ys, tuple):  # 如果输出不是元组，则将其转换为元组
             ys = (ys,)
         outputs = [Variable(as_array(y)) for y in ys]  # 将所有输出变量的data属性转换为Variable对象
+        if self.saved_tensors is not None:
+            self.saved_slots = _saved_slots(self.saved_tensors, xs, ys)
         
-        if Config.enable_backprop:  # 如果启用反向传播，则设置相关属性
-            self.generation = max([x.generation for x in inputs])  # 设置函数的世代为输入变量中最大的世代
-            for output in outputs:
-                output.set_creator(self)   # 设置输出变量的创造者为当前函数对象
-            self.inputs = inputs          # 保存输入变量
-            self.outputs = [weakref.ref(output) for output in outputs]        # 保存输出变量
+        # 启用反向传播，设置相关属性
+        self.generation = max([x.generation for x in inputs])  # 设置函数的世代为输入变量中最大的世代
+        self.serial = next(_serial)
+        for output in outputs:
+            output.set_creator(self)   # 设置输出变量的创造者为当前函数对象
+        self.outputs = [weakref.ref(output) for output in outputs]        # 保存输出变量
+        if self.retains_inputs:
+            self._inputs = inputs     # 保存输入变量
+        else:
+            saved = () if self.saved_tensors is None else self.saved_slots
+            self._inputs = [x if x.creator is None or k in saved else _weak_input(x)
+                            for k, x in enumerate(inputs)]
+        if Config.tangents is not None:
+            _push_tangents(self, inputs, outputs, Config.tangents)
         
         return outputs[0] if len(outputs) == 1 else outputs
+    # 在forward中调用，只保存反向传播真正需要的ndarray，只需要形状的函数什么都不保存
+    def save_for_backward(self, *xs):
+        self.saved_tensors = xs
+
+    # 把保存的ndarray还原为Variable：是输入或输出的数据时返回计算图上的那个变量，
+    # 这样在create_graph=True时也能继续对它们求导
+    @property
+    def saved_variables(self):
+        n = len(self.inputs)
+        variables = []
+        for a, k in zip(self.saved_tensors, self.saved_slots):
+            x = None
+            if k is not None:
+                x = self.inputs[k] if k < n else self.outputs[k - n]()
+            variables.append(Variable(a) if x is None else x)
+        return variables
+
     # 抛出异常，告诉使用Function方法的人此方法应该通过继承来实现
     def forward(self, x):
         raise NotImplementedError()
     
     def backward(self, gy):
         raise NotImplementedError()
+
+    def jvp(self, *tangents):
+        # 前向模式：由输入的切向量（ndarray）计算输出的切向量
+        raise NotImplementedError('{} does not support jvp'.format(type(self).__name__))
+
+    # 一阶导数的快速路径：参数和返回值都是ndarray，不创建任何Function和Variable。
+    # 没有实现时退回到用Variable计算的backward
+    def backward_array(self, *gys):
+        gxs = self.backward(*[None if gy is None else Variable(gy) for gy in gys])
+        if not isinstance(gxs, tuple):
+            gxs = (gxs,)
+        return tuple(None if gx is None else gx.data for gx in gxs)
  
 
 class Add(Function):
+    __slots__ = ('x0_shape', 'x1_shape')
+    retains_inputs = False
+
     def forward(self, x0, x1):
         self.x0_shape, self.x1_shape = x0.shape, x1.shape
-        y = x0 + x1
+        y = apply_ufunc(np.add, x0, x1)
         return y
     
     def backward(self, gy):
@@ -171,32 +637,71 @@ class Add(Function):
             gx0 = dezero.functions.sum_to(gx0, self.x0_shape)
             gx1 = dezero.functions.sum_to(gx1, self.x1_shape)
         return gx0, gx1
+
+    def backward_array(self, gy):
+        gx0, gx1 = gy, gy
+        if self.x0_shape != self.x1_shape:
+            gx0 = utils.sum_to(gx0, self.x0_shape)
+            gx1 = utils.sum_to(gx1, self.x1_shape)
+        return gx0, gx1
+
+    def jvp(self, t0, t1):
+        return t0 + t1
     
 class Mul(Function):
+    __slots__ = ()
+    retains_inputs = False
+
     def forward(self, x0, x1):
-        y = x0 * x1
+        self.save_for_backward(x0, x1)
+        y = apply_ufunc(np.multiply, x0, x1)
         return y
     
     def backward(self, gy):
-        x0, x1 = self.inputs
+        x0, x1 = self.saved_variables
         gx0 = gy * x1
         gx1 = gy * x0
         if x0.shape != x1.shape:    # for broadcast
-            gx0 = dezero.functions.sum_to(gx0, self.x0_shape)
-            gx1 = dezero.functions.sum_to(gx1, self.x1_shape)
+            gx0 = dezero.functions.sum_to(gx0, x0.shape)
+            gx1 = dezero.functions.sum_to(gx1, x1.shape)
         return gx0, gx1
+
+    def backward_array(self, gy):
+        x0, x1 = self.saved_tensors
+        gx0 = apply_ufunc(np.multiply, gy, x1)
+        gx1 = apply_ufunc(np.multiply, gy, x0)
+        if x0.shape != x1.shape:    # for broadcast
+            gx0 = utils.sum_to(gx0, x0.shape)
+            gx1 = utils.sum_to(gx1, x1.shape)
+        return gx0, gx1
+
+    def jvp(self, t0, t1):
+        x0, x1 = self.saved_tensors
+        return t0 * x1 + x0 * t1
     
 class Neg(Function):
+    __slots__ = ()
+    retains_inputs = False
+
     def forward(self, x):
-        return -x
+        return apply_ufunc(np.negative, x)
     
     def backward(self, gy):
         return -gy
+
+    def backward_array(self, gy):
+        return apply_ufunc(np.negative, gy)
+
+    def jvp(self, t):
+        return -t
     
 class Sub(Function):
+    __slots__ = ('x0_shape', 'x1_shape')
+    retains_inputs = False
+
     def forward(self, x0, x1):
         self.x0_shape, self.x1_shape = x0.shape, x1.shape
-        y = x0 - x1
+        y = apply_ufunc(np.subtract, x0, x1)
         return y
     
     def backward(self, gy):
@@ -207,13 +712,28 @@ class Sub(Function):
             gx1 = dezero.functions.sum_to(gx1, self.x1_shape)
         return gx0, gx1
 
+    def backward_array(self, gy):
+        gx0 = gy
+        gx1 = apply_ufunc(np.negative, gy)
+        if self.x0_shape != self.x1_shape:  # for broadcast
+            gx0 = utils.sum_to(gx0, self.x0_shape)
+            gx1 = utils.sum_to(gx1, self.x1_shape)
+        return gx0, gx1
+
+    def jvp(self, t0, t1):
+        return t0 - t1
+
 class Div(Function):
+    __slots__ = ()
+    retains_inputs = False
+
     def forward(self, x0, x1):
-        y = x0 / x1
+        self.save_for_backward(x0, x1)
+        y = apply_ufunc(np.divide, x0, x1)
         return y
     
     def backward(self, gy):
-        x0, x1 = self.inputs
+        x0, x1 = self.saved_variables
         gx0 = gy / x1
         gx1 = gy * (-x0 / x1 ** 2)
         if x0.shape != x1.shape:  # for broadcast
@@ -221,43 +741,205 @@ class Div(Function):
             gx1 = dezero.functions.sum_to(gx1, x1.shape)        
         return gx0, gx1
 
+    def backward_array(self, gy):
+        x0, x1 = self.saved_tensors
+        gx0 = apply_ufunc(np.divide, gy, x1)
+        gx1 = apply_ufunc(np.multiply, gy, -x0 / x1 ** 2)
+        if x0.shape != x1.shape:  # for broadcast
+            gx0 = utils.sum_to(gx0, x0.shape)
+            gx1 = utils.sum_to(gx1, x1.shape)
+        return gx0, gx1
+
+    def jvp(self, t0, t1):
+        x0, x1 = self.saved_tensors
+        return t0 / x1 - x0 * t1 / x1 ** 2
+
 class Pow(Function):
+    __slots__ = ('c',)
+    retains_inputs = False
+
     def __init__(self, c):
         self.c = c
     
     def forward(self, x):
-        return x ** self.c
+        self.save_for_backward(x)
+        return apply_ufunc(np.power, x, self.c)
     
     def backward(self, gy):
-        x, = self.inputs
+        x, = self.saved_variables
         c = self.c
         gx = c * x ** (c - 1) * gy
         return gx
 
+    def backward_array(self, gy):
+        x, = self.saved_tensors
+        c = self.c
+        return c * x ** (c - 1) * gy
+
+    def jvp(self, t):
+        x, = self.saved_tensors
+        c = self.c
+        return c * x ** (c - 1) * t
+
+
+# =============================================================================
+# 与Python标量的运算：标量作为函数的属性而不是计算图的输入，反向传播不为它求梯度
+# =============================================================================
+class AddConstant(Function):
+    __slots__ = ('c',)
+    retains_inputs = False
+
+    def __init__(self, c):
+        self.c = c
+
+    def forward(self, x):
+        return apply_ufunc(np.add, x, self.c)
+
+    def backward(self, gy):
+        return gy
+
+    def backward_array(self, gy):
+        return gy
+
+    def jvp(self, t):
+        return t
+
+class MulConstant(Function):
+    __slots__ = ('c',)
+    retains_inputs = False
+
+    def __init__(self, c):
+        self.c = c
+
+    def forward(self, x):
+        return apply_ufunc(np.multiply, x, self.c)
+
+    def backward(self, gy):
+        return MulConstant(self.c)(gy)
+
+    def backward_array(self, gy):
+        return apply_ufunc(np.multiply, gy, self.c)
+
+    def jvp(self, t):
+        return t * self.c
+
+class SubConstant(Function):
+    __slots__ = ('c',)
+    retains_inputs = False
+
+    def __init__(self, c):
+        self.c = c
+
+    def forward(self, x):
+        return apply_ufunc(np.subtract, x, self.c)
+
+    def backward(self, gy):
+        return gy
+
+    def backward_array(self, gy):
+        return gy
+
+    def jvp(self, t):
+        return t
+
+class RSubConstant(Function):
+    __slots__ = ('c',)
+    retains_inputs = False
+
+    def __init__(self, c):
+        self.c = c
+
+    def forward(self, x):
+        return apply_ufunc(np.subtract, self.c, x)
+
+    def backward(self, gy):
+        return -gy
+
+    def backward_array(self, gy):
+        return apply_ufunc(np.negative, gy)
+
+    def jvp(self, t):
+        return -t
+
+class DivConstant(Function):
+    __slots__ = ('c',)
+    retains_inputs = False
+
+    def __init__(self, c):
+        self.c = c
+
+    def forward(self, x):
+        return apply_ufunc(np.divide, x, self.c)
+
+    def backward(self, gy):
+        return DivConstant(self.c)(gy)
+
+    def backward_array(self, gy):
+        return apply_ufunc(np.divide, gy, self.c)
+
+    def jvp(self, t):
+        return t / self.c
+
+class RDivConstant(Function):
+    __slots__ = ('c',)
+    retains_inputs = False
+
+    def __init__(self, c):
+        self.c = c
+
+    def forward(self, x):
+        self.save_for_backward(x)
+        return apply_ufunc(np.divide, self.c, x)
+
+    def backward(self, gy):
+        x, = self.saved_variables
+        return MulConstant(-self.c)(gy / x ** 2)
+
+    def backward_array(self, gy):
+        x, = self.saved_tensors
+        return apply_ufunc(np.multiply, gy, -self.c / x ** 2)
+
+    def jvp(self, t):
+        x, = self.saved_tensors
+        return -self.c * t / x ** 2
+
 def add(x0, x1):
-    x1 = as_array(x1)
+    if is_literal(x1):
+        return AddConstant(as_constant(x0, x1))(x0)
+    x1 = as_operand(x0, x1)
     return Add()(x0, x1)
 
 def mul(x0, x1):
+    if is_literal(x1):
+        return MulConstant(as_constant(x0, x1))(x0)
+    x1 = as_operand(x0, x1)
     return Mul()(x0, x1)
 
 def neg(x):
     return Neg()(x)
 
 def sub(x0, x1):
-    x1 = as_array(x1)
+    if is_literal(x1):
+        return SubConstant(as_constant(x0, x1))(x0)
+    x1 = as_operand(x0, x1)
     return Sub()(x0, x1)
 
 def rsub(x0, x1):
-    x1 = as_array(x1)
+    if is_literal(x1):
+        return RSubConstant(as_constant(x0, x1))(x0)
+    x1 = as_operand(x0, x1)
     return Sub()(x1, x0)
 
 def div(x0, x1):
-    x1 = as_array(x1)
+    if is_literal(x1):
+        return DivConstant(as_constant(x0, x1))(x0)
+    x1 = as_operand(x0, x1)
     return Div()(x0, x1)
 
 def rdiv(x0, x1):
-    x1 = as_array(x1)
+    if is_literal(x1):
+        return RDivConstant(as_constant(x0, x1))(x0)
+    x1 = as_operand(x0, x1)
     return Div()(x1, x0)
 
 def pow(x, c):
@@ -1,47 +1,135 @@
 import numpy as np
 from dezero import utils
-from dezero.core import Function, as_variable
+from dezero.core import Function, Variable, Config, as_variable, as_array
+from dezero.core import using_config, no_grad, apply_ufunc, jvp, _leaves
 
 class Sin(Function):
+    __slots__ = ()
+    retains_inputs = False
+
     def forward(self, x):
-        y = np.sin(x)
+        self.save_for_backward(x)
+        y = apply_ufunc(np.sin, x)
         return y
 
     def backward(self, gy):
-        x, = self.inputs
+        x, = self.saved_variables
         gx = gy * cos(x)
         return gx
+
+    def backward_array(self, gy):
+        x, = self.saved_tensors
+        return apply_ufunc(np.multiply, gy, apply_ufunc(np.cos, x))
+
+    def jvp(self, t):
+        x, = self.saved_tensors
+        return np.cos(x) * t
     
 def sin(x):
     return Sin()(x)
 
 class Cos(Function):
+    __slots__ = ()
+    retains_inputs = False
+
     def forward(self, x):
-        y = np.cos(x)
+        self.save_for_backward(x)
+        y = apply_ufunc(np.cos, x)
         return y
 
     def backward(self, gy):
-        x, = self.inputs
+        x, = self.saved_variables
         gx = gy * -sin(x)
         return gx
+
+    def backward_array(self, gy):
+        x, = self.saved_tensors
+        return apply_ufunc(np.multiply, gy, apply_ufunc(np.negative, apply_ufunc(np.sin, x)))
+
+    def jvp(self, t):
+        x, = self.saved_tensors
+        return -np.sin(x) * t
     
 def cos(x):
     return Cos()(x)
 
 class Tanh(Function):
+    __slots__ = ()
+    retains_inputs = False
+
     def forward(self, x):
-        y = np.tanh(x)
+        y = as_array(apply_ufunc(np.tanh, x))  # 保存的必须是输出变量的数据本身
+        self.save_for_backward(y)
         return y
 
     def backward(self, gy):
-        y = self.outputs[0]()  # 通过弱引用获取输出
+        y, = self.saved_variables
         gx = gy * (1 - y ** 2)
         return gx
+
+    def backward_array(self, gy):
+        y, = self.saved_tensors
+        return apply_ufunc(np.multiply, gy,
+                           apply_ufunc(np.subtract, 1, apply_ufunc(np.multiply, y, y)))
+
+    def jvp(self, t):
+        y, = self.saved_tensors
+        return (1 - y * y) * t
     
 def tanh(x):
     return Tanh()(x)
 
+class Exp(Function):
+    __slots__ = ()
+    retains_inputs = False
+
+    def forward(self, x):
+        y = as_array(apply_ufunc(np.exp, x))
+        self.save_for_backward(y)
+        return y
+
+    def backward(self, gy):
+        y, = self.saved_variables
+        return gy * y
+
+    def backward_array(self, gy):
+        y, = self.saved_tensors
+        return apply_ufunc(np.multiply, gy, y)
+
+    def jvp(self, t):
+        y, = self.saved_tensors
+        return y * t
+
+def exp(x):
+    return Exp()(x)
+
+class Log(Function):
+    __slots__ = ()
+    retains_inputs = False
+
+    def forward(self, x):
+        self.save_for_backward(x)
+        return apply_ufunc(np.log, x)
+
+    def backward(self, gy):
+        x, = self.saved_variables
+        return gy / x
+
+    def backward_array(self, gy):
+        x, = self.saved_tensors
+        return apply_ufunc(np.divide, gy, x)
+
+    def jvp(self, t):
+        x, = self.saved_tensors
+        return t / x
+
+def log(x):
+    return Log()(x)
+
 class Reshape(Function):
+    __slots__ = ('shape', 'x_shape')
+    retains_inputs = False
+
     def __init__(self, shape):
         self.shape = shape
 
@@ -50,7 +138,13 @@ class Reshape(Function):
         return x.reshape(self.shape)
 
     def backward(self, gy):
-        return np.reshape(gy, self.x_shape)
+        return reshape(gy, self.x_shape)
+
+    def backward_array(self, gy):
+        return gy.reshape(self.x_shape)
+
+    def jvp(self, t):
+        return t.reshape(self.shape)
     
 def reshape(x, shape):
     if x.shape == shape:
@@ -58,6 +152,9 @@ def reshape(x, shape):
     return Reshape(shape)(x)
 
 class Transpose(Function):
+    __slots__ = ('axes',)
+    retains_inputs = False
+
     def __init__(self, axes=None):
         self.axes = axes
 
@@ -70,30 +167,54 @@ class Transpose(Function):
             return transpose(gy)
         axes_len = len(self.axes)
         inv_axes = tuple(np.argsort([ax % axes_len for ax in self.axes]))
+        return transpose(gy, inv_axes)
+
+    def backward_array(self, gy):
+        if self.axes is None:
+            return gy.transpose()
+        axes_len = len(self.axes)
+        inv_axes = tuple(np.argsort([ax % axes_len for ax in self.axes]))
         return gy.transpose(inv_axes)
 
+    def jvp(self, t):
+        return t.transpose(self.axes)
+
 def transpose(x, axes=None):
     return Transpose(axes)(x)
 
 class Sum(Function):
+    __slots__ = ('axis', 'keepdims', 'x_shape')
+    retains_inputs = False
+
     def __init__(self, axis=None, keepdims=False):
         self.axis = axis
         self.keepdims = keepdims
 
     def forward(self, x):
         self.x_shape = x.shape  # 记录输入的形状以便于反向传播时使用
-        y = x.sum(axis=self.axis, keepdims=self.keepdims)
+        # 混合精度时在accum_dtype下求和，避免float16溢出
+        y = x.sum(axis=self.axis, keepdims=self.keepdims, dtype=Config.accum_dtype)
         return y
     
     def backward(self, gy):
         gy = utils.reshape_sum_backward(gy, self.x_shape, self.axis, self.keepdims)
         gx = broadcast_to(gy, self.x_shape)
         return gx
+
+    def backward_array(self, gy):
+        gy = utils.reshape_sum_backward(gy, self.x_shape, self.axis, self.keepdims)
+        return np.broadcast_to(gy, self.x_shape)
+
+    def jvp(self, t):
+        return t.sum(axis=self.axis, keepdims=self.keepdims, dtype=Config.accum_dtype)
     
 def sum(x, axis=None, keepdims=False):
     return Sum(axis, keepdims)(x)
 
 class BroadcastTo(Function):
+    __slots__ = ('shape', 'x_shape')
+    retains_inputs = False
+
     def __init__(self, shape):
         self.shape = shape
 
@@ -105,6 +226,12 @@ class BroadcastTo(Function):
     def backward(self, gy):
         gx = sum_to(gy, self.x_shape)
         return gx
+
+    def backward_array(self, gy):
+        return utils.sum_to(gy, self.x_shape)
+
+    def jvp(self, t):
+        return np.broadcast_to(t, self.shape)
     
 def broadcast_to(x, shape):
     if x.shape == shape:
@@ -112,6 +239,9 @@ def broadcast_to(x, shape):
     return BroadcastTo(shape)(x)
 
 class SumTo(Function):
+    __slots__ = ('shape', 'x_shape')
+    retains_inputs = False
+
     def __init__(self, shape):
         self.shape = shape
 
@@ -123,6 +253,12 @@ class SumTo(Function):
     def backward(self, gy):
         gx = broadcast_to(gy, self.x_shape)
         return gx
+
+    def backward_array(self, gy):
+        return np.broadcast_to(gy, self.x_shape)
+
+    def jvp(self, t):
+        return utils.sum_to(t, self.shape)
     
 def sum_to(x, shape):
     if x.shape == shape:
@@ -130,32 +266,389 @@ def sum_to(x, shape):
     return SumTo(shape)(x)
     
 class MatMul(Function):
+    __slots__ = ()
+    retains_inputs = False
+
     def forward(self, x, W):
-        y = x.dot(W)
+        self.save_for_backward(x, W)
+        y = _dot(x, W)
         return y
     
     def backward(self, gy):
-        x, W = self.inputs
+        x, W = self.saved_variables
         gx = matmul(gy, W.T)
         gW = matmul(x.T, gy)
         return gx, gW
+
+    def backward_array(self, gy):
+        x, W = self.saved_tensors
+        return _dot(gy, W.T), _dot(x.T, gy)
+
+    def jvp(self, tx, tW):
+        x, W = self.saved_tensors
+        return _dot(tx, W) + _dot(x, tW)
     
+def _dot(a, b):
+    pool = Config.memory_pool
+    if pool is None or a.ndim != 2 or b.ndim != 2:
+        return a.dot(b)
+    return np.dot(a, b, out=pool.empty((a.shape[0], b.shape[1]), np.result_type(a, b)))
+
 def matmul(x, W):
     return MatMul()(x, W)
 
+class Linear(Function):
+    __slots__ = ('b_shape',)
+    retains_inputs = False
+
+    def forward(self, x, W, b=None):
+        # 一个节点完成x.dot(W) + b，反向传播一次返回gx、gW、gb
+        self.save_for_backward(x, W)
+        y = _dot(x, W)
+        self.b_shape = None
+        if b is not None:
+            self.b_shape = b.shape
+            if np.result_type(y, b) == y.dtype:
+                y += b  # y是新分配的数组，可以原地加上偏置
+            else:
+                y = y + b
+        return y
+
+    def backward(self, gy):
+        x, W = self.saved_variables
+        gx = matmul(gy, W.T)
+        gW = matmul(x.T, gy)
+        if self.b_shape is None:
+            return gx, gW
+        return gx, gW, sum_to(gy, self.b_shape)
+
+    def backward_array(self, gy):
+        x, W = self.saved_tensors
+        gx = _dot(gy, W.T)
+        gW = _dot(x.T, gy)
+        if self.b_shape is None:
+            return gx, gW
+        return gx, gW, utils.sum_to(gy, self.b_shape)
+
+    def jvp(self, tx, tW, tb=None):
+        x, W = self.saved_tensors
+        ty = _dot(tx, W) + _dot(x, tW)
+        return ty if tb is None else ty + tb
+
+def linear(x, W, b=None):
+    if b is None:
+        return Linear()(x, W)
+    return Linear()(x, W, b)
+
+def linear_simple(x, W, b=None):
+    # 由matmul和加法组成，加上偏置后立即释放中间结果t的数据（反向传播用不到它）。
+    # t仍然在计算图上，换成不占内存的占位数组（步长为0的视图），保留形状和类型
+    t = matmul(x, W)
+    if b is None:
+        return t
+    y = t + b
+    t.data = np.broadcast_to(np.zeros((), t.dtype), t.shape)
+    return y
+
 class MeanSquaredError(Function):
+    __slots__ = ('reduction',)
+
+    def __init__(self, reduction='mean'):
+        # 'mean': 除以批大小len(diff)，'sum': 总和，'none': 逐元素的平方误差
+        if reduction not in ('mean', 'sum', 'none'):
+            raise ValueError('invalid reduction: {}'.format(reduction))
+        self.reduction = reduction
+
     def forward(self, x0, x1):
-        diff = x0 - x1
-        y = (diff ** 2).sum() / len(diff)
+        diff = apply_ufunc(np.subtract, x0, x1)
+        self.save_for_backward(diff)  # 反向传播直接使用，不再重新计算x0 - x1
+        if self.reduction == 'none':
+            return apply_ufunc(np.multiply, diff, diff)
+        y = (diff ** 2).sum(dtype=Config.accum_dtype)
+        if self.reduction == 'mean':
+            y = y / len(diff)
         return y
 
+    def _scale(self, diff):
+        return 2. / len(diff) if self.reduction == 'mean' else 2.
+
     def backward(self, gy):
+        # 只在create_graph=True时调用，diff必须是计算图上的变量
         x0, x1 = self.inputs
         diff = x0 - x1
-        gx0 = gy * diff * (2. / len(diff))
+        gx0 = gy * diff * self._scale(diff)
         gx1 = -gx0
         return gx0, gx1
 
+    def backward_array(self, gy):
+        diff, = self.saved_tensors
+        gx0 = apply_ufunc(np.multiply, diff, gy * self._scale(diff))
+        return gx0, apply_ufunc(np.negative, gx0)
+
+    def jvp(self, t0, t1):
+        diff, = self.saved_tensors
+        t = diff * (t0 - t1)
+        if self.reduction == 'none':
+            return 2. * t
+        return t.sum(dtype=Config.accum_dtype) * self._scale(diff)
+
+
+def mean_squared_error(x0, x1, reduction='mean'):
+    return MeanSquaredError(reduction)(x0, x1)
+
+
+class Sigmoid(Function):
+    __slots__ = ()
+    retains_inputs = False
+
+    def forward(self, x):
+        y = as_array(apply_ufunc(np.tanh, x * 0.5))  # 0.5 * tanh(0.5x) + 0.5不会溢出
+        y *= 0.5
+        y += 0.5
+        self.save_for_backward(y)
+        return y
+
+    def backward(self, gy):
+        y, = self.saved_variables
+        return gy * y * (1 - y)
+
+    def backward_array(self, gy):
+        y, = self.saved_tensors
+        return gy * y * (1 - y)
+
+    def jvp(self, t):
+        y, = self.saved_tensors
+        return y * (1 - y) * t
+
+def sigmoid(x):
+    return Sigmoid()(x)
+
+class Softmax(Function):
+    __slots__ = ('axis',)
+    retains_inputs = False
+
+    def __init__(self, axis=1):
+        self.axis = axis
+
+    def forward(self, x):
+        y = x - x.max(axis=self.axis, keepdims=True)
+        np.exp(y, out=y)
+        y /= y.sum(axis=self.axis, keepdims=True)
+        self.save_for_backward(y)
+        return y
+
+    def backward(self, gy):
+        y, = self.saved_variables
+        gx = y * gy
+        sumdx = sum(gx, axis=self.axis, keepdims=True)
+        return gx - y * sumdx
+
+    def backward_array(self, gy):
+        y, = self.saved_tensors
+        gx = y * gy
+        gx -= y * gx.sum(axis=self.axis, keepdims=True)
+        return gx
+
+    def jvp(self, t):
+        y, = self.saved_tensors
+        ty = y * t
+        ty -= y * ty.sum(axis=self.axis, keepdims=True)
+        return ty
+
+def softmax(x, axis=1):
+    return Softmax(axis)(x)
+
+
+def _is_label(t, x):
+    # 整数数组且比x少一维时，t是类别编号；否则是与x形状相同的（软）目标
+    return t.dtype.kind in 'iu' and t.ndim == x.ndim - 1
+
+class SoftmaxCrossEntropy(Function):
+    __slots__ = ()
+
+    def forward(self, x, t):
+        # log(softmax(x)) = x - logsumexp(x)，不会出现exp的溢出和log(0)
+        N = x.shape[0]
+        log_p = x - utils.logsumexp(x, axis=1)
+        self.save_for_backward(log_p, t)
+        if _is_label(t, x):
+            # 只取出正确类别的对数概率，不生成one-hot数组
+            log_p = log_p[np.arange(N), t]
+        else:
+            log_p = log_p * t
+        return -log_p.sum(dtype=Config.accum_dtype) / N
+
+    def backward(self, gy):
+        # 只在create_graph=True时调用
+        x, t = self.inputs
+        N, CLS_NUM = x.shape
+        y = softmax(x)
+        t = t.data
+        if _is_label(t, x.data):
+            gx = y - np.eye(CLS_NUM, dtype=y.dtype)[t]
+        else:
+            gx = y * t.sum(axis=1, keepdims=True) - t  # 每行的目标之和不一定是1
+        gx = gx * (gy / N)
+        return gx, None
+
+    def backward_array(self, gy):
+        log_p, t = self.saved_tensors
+        N = log_p.shape[0]
+        gx = np.exp(log_p)  # softmax(x)
+        if _is_label(t, log_p):
+            gx[np.arange(N), t] -= 1
+        else:
+            gx *= t.sum(axis=1, keepdims=True)
+            gx -= t
+        return gx * (gy / N), None
+
+    def jvp(self, tx, tt):
+        log_p, t = self.saved_tensors
+        N = log_p.shape[0]
+        t_log_p = tx - (np.exp(log_p) * tx).sum(axis=1, keepdims=True)
+        if _is_label(t, log_p):
+            return -t_log_p[np.arange(N), t].sum(dtype=Config.accum_dtype) / N
+        return -((t * t_log_p).sum(dtype=Config.accum_dtype) +
+                 (tt * log_p).sum(dtype=Config.accum_dtype)) / N
+
+def softmax_cross_entropy(x, t):
+    return SoftmaxCrossEntropy()(x, t)
+
+class SigmoidCrossEntropy(Function):
+    __slots__ = ()
+
+    def forward(self, x, t):
+        # -(t*log(p) + (1-t)*log(1-p)) = max(x, 0) - x*t + log(1 + exp(-|x|))
+        t = t.reshape(x.shape)
+        self.save_for_backward(x, t)
+        loss = np.maximum(x, 0) - x * t + np.log1p(np.exp(-np.abs(x)))
+        return loss.sum(dtype=Config.accum_dtype) / len(x)
+
+    def backward(self, gy):
+        # 只在create_graph=True时调用
+        x, t = self.inputs
+        t = t.data.reshape(x.shape)
+        gx = (sigmoid(x) - t) * (gy / len(x))
+        return gx, None
+
+    def backward_array(self, gy):
+        x, t = self.saved_tensors
+        p = np.tanh(x * 0.5)
+        p *= 0.5
+        p += 0.5
+        p -= t
+        return p * (gy / len(x)), None
+
+    def jvp(self, tx, tt):
+        x, t = self.saved_tensors
+        p = np.tanh(x * 0.5) * 0.5 + 0.5
+        tt = tt.reshape(x.shape)
+        return ((p - t) * tx - x * tt).sum(dtype=Config.accum_dtype) / len(x)
+
+def sigmoid_cross_entropy(x, t):
+    return SigmoidCrossEntropy()(x, t)
+
+
+class Checkpoint(Function):
+    __slots__ = ('fn',)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def forward(self, *xs):
+        # 前向时不记录fn内部的计算图，只保存输入，中间结果在计算后立即释放
+        with no_grad():
+            ys = self.fn(*[Variable(x) for x in xs])
+        self.save_for_backward(*xs)
+        if isinstance(ys, (tuple, list)):
+            return tuple(as_variable(y).data for y in ys)
+        return as_variable(ys).data
+
+    def _recompute_backward(self, xs, gys):
+        # 反向传播到达这里时，在输入的副本xs上记录计算图重新计算一遍，再对这一段做反向传播
+        # fn中用到的参数（例如W、b）的梯度在这里直接累加
+        with using_config('enable_backprop', True):
+            ys = self.fn(*xs)
+            if not isinstance(ys, (tuple, list)):
+                ys = (ys,)
+            ys = [as_variable(y) for y in ys]
+            if len(ys) == 1:
+                y = ys[0]
+                y.grad = gys[0]
+            else:
+                y = None
+                for yi, gy in zip(ys, gys):
+                    if gy is not None:
+                        t = sum(yi * gy)
+                        y = t if y is None else y + t
+        if y is not None:
+            # hvp（传播切向量时）只对输入求导，fn中用到的参数的梯度保持原样
+            others = []
+            if Config.tangents is not None:
+                others = [(v, v.grad) for v in _leaves(y) if all(v is not x for x in xs)]
+            y.backward(create_graph=Config.enable_backprop)
+            for v, grad in others:
+                v.grad = grad
+        return tuple(x.grad for x in xs)
+
+    def backward_array(self, *gys):
+        xs = [Variable(x) for x in self.saved_tensors]
+        gxs = self._recompute_backward(
+            xs, [None if gy is None else Variable(as_array(gy)) for gy in gys])
+        return tuple(None if gx is None else gx.data for gx in gxs)
+
+    def backward(self, *gys):
+        tangents = Config.tangents
+        if Config.enable_backprop:
+            return self._connected_backward(gys)
+        if tangents is None:
+            # 不记录计算图也不传播切向量时，与backward_array相同
+            gxs = self.backward_array(*[None if gy is None else gy.data for gy in gys])
+            return tuple(None if gx is None else Variable(gx) for gx in gxs)
+        # hvp：输入的副本带上原来输入的切向量，重新计算和反向传播时切向量随之传播，
+        # 返回的梯度带有切向量（gys的切向量也在tangents中）
+        xs = [Variable(x) for x in self.saved_tensors]
+        for x, x0 in zip(xs, self.inputs):
+            if x0 in tangents:
+                tangents[x] = tangents[x0]
+        return self._recompute_backward(xs, gys)
+
+    def _connected_backward(self, gys):
+        # create_graph=True：在原来的输入和gys上各接一个恒等的Reshape作为边界，从边界开始重新计算。
+        # 反向传播时暂时断开边界，只对重新计算的这一段求导；之后接回去，
+        # 得到的梯度经由边界连到外面的计算图上，可以继续求导
+        xs = [Reshape(x.shape)(x) for x in self.inputs]
+        gys = [None if gy is None else Reshape(gy.shape)(gy) for gy in gys]
+        bounds = [v for v in xs + gys if v is not None]
+        creators = [v.creator for v in bounds]
+        for v in bounds:
+            v.creator = None
+        try:
+            gxs = self._recompute_backward(xs, gys)
+        finally:
+            for v, f in zip(bounds, creators):
+                v.creator = f
+                v.grad = None  # 边界之后是中间变量，不能留下梯度
+        return gxs
+
+    def jvp(self, *tangents):
+        # 在输入上重新计算一遍，同时传播切向量
+        ys, tys = jvp(self.fn, self.saved_tensors, tangents)
+        if isinstance(tys, tuple):
+            return tuple(t.data for t in tys)
+        return tys.data
+
+def checkpoint(fn, *inputs):
+    return Checkpoint(fn)(*inputs)
+
+def checkpoint_sequential(layers, k, x):
+    # 每k层作为一段做checkpoint，反向传播时只保存每段的输入
+    for i in range(0, len(layers), k):
+        segment = layers[i:i + k]
 
-def mean_squared_error(x0, x1):
-    return MeanSquaredError()(x0, x1)
+        def run(h, segment=segment):
+            for layer in segment:
+                h = layer(h)
+            return h
+        x = checkpoint(run, x)
+    return x
@@ -0,0 +1,61 @@
+import numpy as np
+from dezero.core import Variable, as_array, no_grad, hvp
+
+
+def _dot(xs, ys):
+    return sum(float((x * y).sum()) for x, y in zip(xs, ys))
+
+
+class NewtonCG:
+    # 牛顿法：每一步用共轭梯度法近似求解 (H + damping*I) p = -g。
+    # H·v由dezero.hvp计算，不需要构造海森矩阵，也不需要create_graph的二阶计算图
+    def __init__(self, cg_iters=20, tol=1e-10, damping=0.0, line_search=True):
+        self.cg_iters = cg_iters
+        self.tol = tol
+        self.damping = damping
+        self.line_search = line_search
+
+    def update(self, f, params):
+        # f接收与params个数相同的变量并返回标量损失，更新params的data，返回更新前的损失
+        xs = [Variable(p.data) for p in params]
+        loss = f(*xs)
+        loss.backward()
+        g = [np.zeros_like(x.data) if x.grad is None else x.grad.data for x in xs]
+        step = self._solve(f, [p.data for p in params], g)
+
+        t = 1.0
+        if self.line_search:
+            # 回溯直线搜索（Armijo条件）
+            slope = _dot(g, step)
+            with no_grad():
+                while t > 1e-4:
+                    new_loss = f(*[Variable(as_array(p.data + t * s))
+                                   for p, s in zip(params, step)])
+                    if new_loss.data <= loss.data + 1e-4 * t * slope:
+                        break
+                    t *= 0.5
+        for p, s in zip(params, step):
+            p.data = as_array(p.data + t * s)
+        return loss
+
+    def _solve(self, f, data, g):
+        x = [np.zeros_like(gi) for gi in g]
+        r = [-gi for gi in g]
+        d = [ri.copy() for ri in r]
+        rr = _dot(r, r)
+        for i in range(self.cg_iters):
+            if rr < self.tol:
+                break
+            Hd = [h.data for h in hvp(f, data, d)]
+            if self.damping:
+                Hd = [h + self.damping * di for h, di in zip(Hd, d)]
+            dHd = _dot(d, Hd)
+            if dHd <= 0:
+                # 负曲率：第一次迭代就出现时沿负梯度方向
+                return d if i == 0 else x
+            alpha = rr / dHd
+            x = [xi + alpha * di for xi, di in zip(x, d)]
+            r = [ri - alpha * h for ri, h in zip(r, Hd)]
+            rr, rr_old = _dot(r, r), rr
+            d = [ri + (rr / rr_old) * di for ri, di in zip(r, d)]
+        return x
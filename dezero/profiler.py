@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from dezero.core import Function, Variable
+
+
+def _subclasses(cls):
+    for sub in cls.__subclasses__():
+        yield sub
+        yield from _subclasses(sub)
+
+
+def _allocated(y, inputs):
+    # 输入的视图（reshape、transpose、broadcast_to等）不分配内存，不计入。
+    # 非连续数组的reshape会先复制再返回视图，此时base不是输入，仍然计入
+    if y.base is not None:
+        for x in inputs:
+            x = getattr(x, 'data', x)
+            if isinstance(x, np.ndarray) and np.may_share_memory(y, x):
+                return 0
+    return y.nbytes
+
+
+class Profiler:
+    # 只在with块内替换Function.__call__和各个函数的backward，
+    # 不使用时计算图的执行路径上没有任何额外的判断
+    def __init__(self):
+        self.stats = {}   # 函数名 -> [调用次数, 前向时间, 反向次数, 反向时间, 输出字节数]
+        self.events = []  # (名称, 类别, 开始时间, 结束时间, 线程)
+        self._lock = threading.Lock()
+        self._patched = []
+
+    def _record(self, name, cat, start, end, nbytes=0):
+        with self._lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = [0, 0.0, 0, 0.0, 0]
+            if cat == 'forward':
+                stat[0] += 1
+                stat[1] += end - start
+                stat[4] += nbytes
+            elif cat == 'backward':
+                stat[2] += 1
+                stat[3] += end - start
+            self.events.append((name, cat, start, end, threading.get_ident()))
+
+    def _patch(self, cls, name, method):
+        self._patched.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, method)
+
+    def __enter__(self):
+        profiler = self
+        call = Function.__call__
+
+        def profiled_call(f, *inputs):
+            start = time.perf_counter()
+            outputs = call(f, *inputs)
+            end = time.perf_counter()
+            ys = outputs if isinstance(outputs, list) else [outputs]
+            nbytes = sum(_allocated(y.data, inputs) for y in ys if y.data is not None)
+            profiler._record(type(f).__name__, 'forward', start, end, nbytes)
+            return outputs
+        self._patch(Function, '__call__', profiled_call)
+
+        def wrap_backward(cls, backward):
+            name = cls.__name__
+
+            def profiled_backward(f, *gys):
+                start = time.perf_counter()
+                gxs = backward(f, *gys)
+                profiler._record(name, 'backward', start, time.perf_counter())
+                return gxs
+            return profiled_backward
+
+        for cls in _subclasses(Function):
+            for name in ('backward', 'backward_array'):
+                if name in cls.__dict__:
+                    self._patch(cls, name, wrap_backward(cls, cls.__dict__[name]))
+
+        variable_backward = Variable.backward
+
+        def profiled_variable_backward(v, *args, **kwargs):
+            start = time.perf_counter()
+            variable_backward(v, *args, **kwargs)
+            profiler._record('Variable.backward', 'backprop', start, time.perf_counter())
+        self._patch(Variable, 'backward', profiled_variable_backward)
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._patched:
+            cls, name, method = self._patched.pop()
+            setattr(cls, name, method)
+
+    def table(self, sort_by='total'):
+        # sort_by: 'total', 'forward', 'backward', 'calls', 'bytes'
+        keys = {
+            'total': lambda s: s[1] + s[3],
+            'forward': lambda s: s[1],
+            'backward': lambda s: s[3],
+            'calls': lambda s: s[0],
+            'bytes': lambda s: s[4],
+        }
+        key = keys[sort_by]
+        rows = sorted(self.stats.items(), key=lambda item: key(item[1]), reverse=True)
+        lines = ['{:<20} {:>8} {:>12} {:>12} {:>12} {:>14}'.format(
+            'Function', 'calls', 'forward(ms)', 'backward(ms)', 'total(ms)', 'output bytes')]
+        for name, (calls, ftime, _, btime, nbytes) in rows:
+            if name == 'Variable.backward':
+                continue
+            lines.append('{:<20} {:>8} {:>12.3f} {:>12.3f} {:>12.3f} {:>14}'.format(
+                name, calls, ftime * 1e3, btime * 1e3, (ftime + btime) * 1e3, nbytes))
+        return '\n'.join(lines)
+
+    def export_chrome_trace(self, path):
+        # 可以在chrome://tracing或Perfetto中打开
+        pid = os.getpid()
+        events = [{'name': name, 'cat': cat, 'ph': 'X', 'pid': pid, 'tid': tid,
+                   'ts': start * 1e6, 'dur': (end - start) * 1e6}
+                  for name, cat, start, end, tid in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+
+
+def profile():
+    # with dezero.profile() as p:
+    #     ...
+    # print(p.table())
+    return Profiler()
@@ -0,0 +1,132 @@
+import time
+import queue
+import asyncio
+import threading
+import collections
+from concurrent.futures import Future
+import numpy as np
+from dezero.core import Variable, no_grad
+
+
+class BatchingServer:
+    # 把单个样本的请求合并成批次后再执行模型的前向计算。
+    # 第一个请求到达后最多等待max_latency秒，或者凑满max_batch_size个就立即执行
+    def __init__(self, model, max_batch_size=32, max_latency=0.005, history=10000):
+        self.model = model  # 接收(N, ...)的输入，返回(N, ...)的输出
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.latencies = collections.deque(maxlen=history)  # 最近请求的延迟（秒）
+        self.batch_sizes = collections.deque(maxlen=history)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()  # 保证close之后不会再有请求进入队列
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._closed = False
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+        return self
+
+    def close(self):
+        with self._lock:
+            thread = self._thread
+            self._closed = True
+            if thread is not None:
+                self._queue.put(None)
+                self._thread = None
+        if thread is not None:
+            thread.join()
+        # 没有启动过（或已经停止）时，队列中剩下的请求不会再被执行，让它们以异常结束
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError('BatchingServer was closed before '
+                                                   'the request was run'))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, x):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('cannot submit to a closed BatchingServer')
+            self._queue.put((np.asarray(x), future, time.perf_counter()))
+        return future
+
+    def predict(self, x):
+        return self.submit(x).result()
+
+    async def predict_async(self, x):
+        return await asyncio.wrap_future(self.submit(x))
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = item[2] + self.max_latency
+            closing = False
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 \
+                        else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            self._run(batch)
+            if closing:
+                return
+
+    def _run(self, batch):
+        # 已经被调用者取消的请求不再执行
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        futures = [future for _, future, _ in batch]
+        try:
+            x = np.stack([x for x, _, _ in batch])
+            with no_grad():
+                y = self.model(Variable(x))
+            ys = y.data if isinstance(y, Variable) else np.asarray(y)
+            if ys.ndim == 0 or len(ys) != len(batch):
+                raise ValueError('model returned output of shape {} for a batch of {} '
+                                 'requests; expected one row per request'.format(
+                                     ys.shape, len(batch)))
+        except Exception as e:
+            # 任何失败都要让这一批的所有请求结束，否则predict()会一直等待
+            for future in futures:
+                future.set_exception(e)
+            return
+        end = time.perf_counter()
+        for (_, future, start), y in zip(batch, ys):
+            future.set_result(y)
+            self.latencies.append(end - start)
+        self.batch_sizes.append(len(batch))
+
+    def metrics(self):
+        latencies = np.array(self.latencies)
+        if len(latencies):
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        else:
+            p50 = p90 = p99 = 0.0
+        return {
+            'queue_depth': self._queue.qsize(),
+            'requests': len(latencies),
+            'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            'p50': p50, 'p90': p90, 'p99': p99,
+        }
@@ -0,0 +1,220 @@
+import numpy as np
+from dezero import utils
+from dezero.core import Variable, using_config
+from dezero.core import Add, Sub, Mul, Div, Neg, Pow
+from dezero.core import AddConstant, SubConstant, MulConstant, DivConstant
+from dezero.functions import Reshape, Transpose, BroadcastTo, SumTo
+
+
+# =============================================================================
+# 代数化简规则：返回与函数输出等价的变量，不能化简时返回None
+# =============================================================================
+def _all(v, value):
+    return v.data is not None and v.data.size <= 64 and bool(np.all(v.data == value))
+
+def _output(f):
+    return f.outputs[0]()
+
+def _same_shape(f, xs, is_const):
+    # 只改变形状的函数，输出与输入形状相同时就是恒等变换
+    y = _output(f)
+    if y is not None and y.shape == xs[0].shape:
+        return xs[0]
+
+def _axes(axes, ndim):
+    if axes is None:
+        return tuple(range(ndim))[::-1]
+    return tuple(a % ndim for a in axes)
+
+def _transpose(f, xs, is_const):
+    x, = xs
+    axes = _axes(f.axes, x.ndim)
+    if axes == tuple(range(x.ndim)):
+        return x
+    inner = x.creator
+    if isinstance(inner, Transpose):
+        inner_axes = _axes(inner.axes, x.ndim)
+        if tuple(inner_axes[a] for a in axes) == tuple(range(x.ndim)):
+            return inner.inputs[0]
+
+def _sum_to(f, xs, is_const):
+    x, = xs
+    if x.shape == tuple(f.shape):
+        return x
+    inner = x.creator
+    if isinstance(inner, BroadcastTo) and inner.inputs[0].shape == tuple(f.shape):
+        # sum_to(broadcast_to(x, shape), x.shape) = x * 广播的倍数
+        x0 = inner.inputs[0]
+        k = x.size // x0.size
+        return x0 if k == 1 else x0 * k
+
+def _neg(f, xs, is_const):
+    inner = xs[0].creator
+    if isinstance(inner, Neg):
+        return inner.inputs[0]
+
+def _pow(f, xs, is_const):
+    if f.c == 1:
+        return xs[0]
+
+def _mul(f, xs, is_const):
+    y = _output(f)
+    if y is None:
+        return None
+    x0, x1 = xs
+    for a, c in ((x0, x1), (x1, x0)):
+        if not is_const(c):
+            continue
+        if _all(c, 1) and a.shape == y.shape:
+            return a
+        if isinstance(a.creator, Mul):
+            # (v * c1) * c2 -> v * (c1 * c2)
+            v0, v1 = a.creator.inputs
+            for v, c1 in ((v0, v1), (v1, v0)):
+                if is_const(c1):
+                    k = np.asarray(c1.data * c.data)
+                    if np.broadcast_shapes(v.shape, k.shape) == y.shape:
+                        return v * Variable(k)
+
+def _add(f, xs, is_const):
+    y = _output(f)
+    x0, x1 = xs
+    for a, c in ((x0, x1), (x1, x0)):
+        if y is not None and is_const(c) and _all(c, 0) and a.shape == y.shape:
+            return a
+
+def _sub(f, xs, is_const):
+    y = _output(f)
+    x0, x1 = xs
+    if y is not None and is_const(x1) and _all(x1, 0) and x0.shape == y.shape:
+        return x0
+
+def _div(f, xs, is_const):
+    y = _output(f)
+    x0, x1 = xs
+    if y is not None and is_const(x1) and _all(x1, 1) and x0.shape == y.shape:
+        return x0
+
+def _constant_is(value):
+    # x + 0、x - 0、x * 1、x / 1：常量是0维的，输出与x形状相同
+    def rule(f, xs, is_const):
+        if f.c == value:
+            return xs[0]
+    return rule
+
+def _mul_constant(f, xs, is_const):
+    if f.c == 1:
+        return xs[0]
+    inner = xs[0].creator
+    if isinstance(inner, MulConstant):
+        # (v * c1) * c2 -> v * (c1 * c2)
+        return MulConstant(np.multiply(inner.c, f.c))(inner.inputs[0])
+    if isinstance(inner, Neg):
+        # (-v) * c -> v * (-c)
+        return MulConstant(np.negative(f.c))(inner.inputs[0])
+
+_RULES = {
+    Reshape: _same_shape,
+    BroadcastTo: _same_shape,
+    Transpose: _transpose,
+    SumTo: _sum_to,
+    Neg: _neg,
+    Pow: _pow,
+    Mul: _mul,
+    Add: _add,
+    Sub: _sub,
+    Div: _div,
+    AddConstant: _constant_is(0),
+    SubConstant: _constant_is(0),
+    MulConstant: _mul_constant,
+    DivConstant: _constant_is(1),
+}
+
+
+def simplify(outputs, wrt=None):
+    # 在记录好的计算图上做公共子表达式消除、常量折叠和代数化简，返回化简后的输出。
+    # 原来的计算图会被直接修改（函数的输入被替换为等价的变量），
+    # 之后可以对返回的变量继续调用backward(create_graph=True)
+    # wrt: 之后要求导的变量。给出wrt时，其他的叶子变量被视为常量，可以被折叠；
+    # 不给出时所有叶子变量都当作参数，只做不依赖常量的化简
+    single = not isinstance(outputs, (tuple, list))
+    outputs = [outputs] if single else list(outputs)
+    wrt_ids = None if wrt is None else {id(x) for x in
+                                        (wrt if isinstance(wrt, (tuple, list)) else [wrt])}
+
+    funcs = []
+    seen_set = set()
+    stack = [y.creator for y in outputs if y.creator is not None]
+    while stack:
+        f = stack.pop()
+        if f not in seen_set:
+            seen_set.add(f)
+            funcs.append(f)
+            stack.extend(x.creator for x in f.inputs if x.creator is not None)
+    funcs.sort(key=lambda f: f.generation)  # 输入的创造者先处理
+
+    folded = set()  # 常量折叠得到的变量
+    def is_const(v):
+        return v.creator is None and (id(v) in folded or
+                                      (wrt_ids is not None and id(v) not in wrt_ids))
+
+    rep = {}        # id(变量) -> 等价的变量
+    canonical = {}  # (函数的类型和属性, 输入) -> 函数
+    constants = {}  # 值相同的小常量只保留一个
+    alive = []      # 保持被替换的变量存活，避免id被复用
+
+    with using_config('enable_backprop', True):
+        for f in funcs:
+            # 1. 把输入替换为等价的变量，反向传播要用的数据也随之替换
+            inputs = []
+            for x in f.inputs:
+                z = rep.get(id(x), x)
+                if is_const(z) and z.data is not None and z.data.size <= 16:
+                    z = constants.setdefault(
+                        (z.data.dtype.str, z.data.shape, z.data.tobytes()), z)
+                inputs.append(z)
+            if any(z is not x for x, z in zip(f.inputs, inputs)):
+                if f.saved_tensors is not None:
+                    n = len(inputs)
+                    f.saved_tensors = tuple(
+                        inputs[k].data if k is not None and k < n else a
+                        for a, k in zip(f.saved_tensors, f.saved_slots))
+                alive.extend(f.inputs)
+                f.inputs = inputs
+
+            ys = [y() for y in f.outputs]
+            # 2. 代数化简
+            rule = _RULES.get(type(f))
+            z = None if rule is None else rule(f, inputs, is_const)
+            if z is not None:
+                replacements = [z]
+            elif all(is_const(x) for x in inputs) and \
+                    all(y is not None and y.data is not None for y in ys):
+                # 3. 常量折叠：输入都是常量时，输出也是常量
+                replacements = []
+                for y in ys:
+                    c = Variable(y.data)
+                    folded.add(id(c))
+                    replacements.append(c)
+            else:
+                # 4. 公共子表达式消除：同样的函数作用在同样的输入上。
+                # 属性不能安全比较的函数（_func_key为None）不参与合并
+                fkey = utils._func_key(f)
+                key = None if fkey is None else (fkey, tuple(id(x) for x in inputs))
+                g = f if key is None else canonical.setdefault(key, f)
+                replacements = None
+                if g is not f:
+                    zs = [z() for z in g.outputs]
+                    if all(z is not None for z in zs):
+                        replacements = zs
+                    else:
+                        canonical[key] = f
+            if replacements is not None:
+                for y, z in zip(ys, replacements):
+                    if y is not None:
+                        rep[id(y)] = z
+                        alive.append(y)
+                        alive.append(z)
+
+    outputs = [rep.get(id(y), y) for y in outputs]
+    return outputs[0] if single else outputs
@@ -0,0 +1,500 @@
+import math
+import weakref
+import threading
+import numpy as np
+from dezero import utils
+from dezero.core import Function, Variable, Config, as_variable, as_array
+from dezero.core import using_config, no_grad, _serial
+from dezero.core import Add, Sub, Mul, Div, Neg, Pow
+from dezero.core import AddConstant, SubConstant, RSubConstant, MulConstant
+from dezero.core import DivConstant, RDivConstant
+from dezero.functions import Sin, Cos, Tanh, Exp, Log, Sigmoid
+
+
+# =============================================================================
+# 记录一次计算图，之后直接在ndarray上重放
+# =============================================================================
+class Program:
+    def __init__(self, ops, n_inputs, leaves, outputs, n_slots):
+        self.ops = ops            # [(f, 输入槽位, 输出槽位)]，已按世代排好序
+        self.n_inputs = n_inputs  # 槽位[0, n_inputs)是调用时传入的参数
+        self.leaves = leaves      # 函数内部引用的外部变量（例如参数W、b），紧跟在参数后面
+        self.outputs = outputs    # 输出所在的槽位
+        self.n_slots = n_slots
+        self.scalar = False       # 所有的值都是0维float64，并且所有运算都能在float上执行
+        # 函数对象是多次调用共用的，执行时会临时在上面放本次的数据（saved_tensors等）。
+        # 每个运算一把锁，多个线程同时调用时逐个运算互斥，不同的运算仍然可以并行
+        self.locks = [threading.Lock() for _ in ops]
+
+    @staticmethod
+    def record(fn, inputs):
+        # 用新的叶子变量执行一次fn，使记录下的图不会连到调用者的图上
+        xs = [Variable(x.data) for x in inputs]
+        start = next(_serial)
+        with using_config('enable_backprop', True):
+            outputs = fn(*xs)
+        if not isinstance(outputs, (tuple, list)):
+            outputs = (outputs,)
+        outputs = [as_variable(y) for y in outputs]
+
+        # 只记录执行fn时创建的函数。fn引用的、之前就已经算好的变量（例如W2 = W * 2）
+        # 作为叶子变量，它们的计算图属于调用者，不能被修改
+        def recorded(v):
+            return v.creator is not None and v.creator.serial > start
+
+        funcs = []
+        seen_set = set()
+        stack = [y.creator for y in outputs if recorded(y)]
+        while stack:
+            f = stack.pop()
+            if f not in seen_set:
+                seen_set.add(f)
+                funcs.append(f)
+                stack.extend(x.creator for x in f.inputs if recorded(x))
+        # 函数的世代一定大于其输入的创造者，按世代升序就是一个合法的前向顺序
+        funcs.sort(key=lambda f: f.generation)
+
+        slots = {id(x): i for i, x in enumerate(xs)}
+        leaves = []
+        for f in funcs:
+            for x in f.inputs:
+                if not recorded(x) and id(x) not in slots:
+                    leaves.append(x)
+                    slots[id(x)] = len(slots)
+        for y in outputs:
+            if not recorded(y) and id(y) not in slots:
+                leaves.append(y)
+                slots[id(y)] = len(slots)
+
+        ops = []
+        for f in funcs:
+            outs = []
+            for y in f.outputs:
+                y = y()
+                slots[id(y)] = len(slots)
+                outs.append(slots[id(y)])
+            ops.append((f, [slots[id(x)] for x in f.inputs], outs))
+
+        program = Program(ops, len(xs), leaves, [slots[id(y)] for y in outputs],
+                          len(slots))
+        values = xs + leaves + [y() for f in funcs for y in f.outputs]
+        program.scalar = all(_is_scalar(f) for f in funcs) and \
+            all(v.data.shape == () and v.data.dtype == np.float64 for v in values)
+        # 断开记录时的计算图，重放时只需要函数对象本身（形状等属性）
+        for f in funcs:
+            f.inputs = None
+            f.outputs = None
+        return program
+
+    def forward(self, xs):
+        values = list(xs) + [None] * (self.n_slots - len(xs))
+        saved = []  # 每个运算这次保存的数据，函数对象是多次调用共用的，不能留在它上面
+        for (f, ins, outs), lock in zip(self.ops, self.locks):
+            with lock:
+                f.saved_tensors = None
+                ys = f.forward(*[values[i] for i in ins])
+                saved.append(f.saved_tensors)
+                f.saved_tensors = None
+            if not isinstance(ys, tuple):
+                ys = (ys,)
+            for o, y in zip(outs, ys):
+                values[o] = as_array(y)
+        return values, saved
+
+    def backward(self, values, saved, gys):
+        grads = [None] * self.n_slots
+        for o, gy in zip(self.outputs, gys):
+            grads[o] = gy if grads[o] is None else grads[o] + gy
+
+        with no_grad():
+            for (f, ins, outs), saved_tensors, lock in zip(
+                    reversed(self.ops), reversed(saved), reversed(self.locks)):
+                gys = [np.zeros_like(values[o]) if grads[o] is None else grads[o]
+                       for o in outs]
+                with lock:
+                    f.saved_tensors = saved_tensors
+                    fallback = type(f).backward_array is Function.backward_array
+                    if fallback:
+                        # 没有实现backward_array的函数要用inputs/outputs，临时绑定到本次的数据上
+                        f.inputs = [Variable(values[i]) for i in ins]
+                        ys = [Variable(values[o]) for o in outs]
+                        f.outputs = [weakref.ref(y) for y in ys]
+                    try:
+                        gxs = f.backward_array(*gys)
+                    finally:
+                        if fallback:
+                            f.inputs = None
+                            f.outputs = None
+                        f.saved_tensors = None
+                if not isinstance(gxs, tuple):
+                    gxs = (gxs,)
+                for i, gx in zip(ins, gxs):
+                    if gx is not None:
+                        grads[i] = gx if grads[i] is None else grads[i] + gx
+        return grads[:self.n_inputs + len(self.leaves)]
+
+
+# =============================================================================
+# 逐元素运算的融合
+# =============================================================================
+_ELEMENTWISE = {
+    Add: np.add,
+    Sub: np.subtract,
+    Mul: np.multiply,
+    Div: np.divide,
+    Neg: np.negative,
+    Pow: np.power,
+    AddConstant: np.add,
+    SubConstant: np.subtract,
+    RSubConstant: np.subtract,
+    MulConstant: np.multiply,
+    DivConstant: np.divide,
+    RDivConstant: np.divide,
+}
+
+# 作为属性保存的常量在ufunc参数中的位置
+_CONSTANT_FIRST = (RSubConstant, RDivConstant)
+_CONSTANT_LAST = (Pow, AddConstant, SubConstant, MulConstant, DivConstant)
+
+# 逐元素运算的解析梯度，参数为(函数, 输入的ndarray, gy)
+_ELEMENTWISE_GRAD = {
+    Add: lambda f, xs, gy: (gy, gy),
+    Sub: lambda f, xs, gy: (gy, -gy),
+    Mul: lambda f, xs, gy: (gy * xs[1], gy * xs[0]),
+    Div: lambda f, xs, gy: (gy / xs[1], gy * (-xs[0] / xs[1] ** 2)),
+    Neg: lambda f, xs, gy: (-gy,),
+    Pow: lambda f, xs, gy: (f.c * xs[0] ** (f.c - 1) * gy,),
+    AddConstant: lambda f, xs, gy: (gy,),
+    SubConstant: lambda f, xs, gy: (gy,),
+    RSubConstant: lambda f, xs, gy: (-gy,),
+    MulConstant: lambda f, xs, gy: (gy * f.c,),
+    DivConstant: lambda f, xs, gy: (gy / f.c,),
+    RDivConstant: lambda f, xs, gy: (gy * (-f.c / xs[0] ** 2),),
+}
+
+# 反向传播时需要用到输入值的运算，它们的输入不能被复用
+_NEEDS_INPUTS = (Mul, Div, Pow, RDivConstant)
+
+
+class FusedElementwise(Function):
+    __slots__ = ('nodes', 'n_inputs', 'uses', 'keep')
+
+    def __init__(self, nodes, n_inputs):
+        # nodes: [(f, refs)]，refs中小于n_inputs的是外部输入，
+        # 否则是第(ref - n_inputs)个节点的输出
+        self.nodes = nodes
+        self.n_inputs = n_inputs
+        self.uses = [0] * (n_inputs + len(nodes))
+        self.keep = [False] * (n_inputs + len(nodes))
+        for f, refs in nodes:
+            for r in refs:
+                self.uses[r] += 1
+                if isinstance(f, _NEEDS_INPUTS):
+                    self.keep[r] = True
+
+    def forward(self, *xs):
+        n_in = self.n_inputs
+        last = len(self.nodes) - 1
+        uses = list(self.uses)
+        free = {}  # (形状, 类型) -> 可以复用的临时数组
+        values = list(xs)
+        for j, (f, refs) in enumerate(self.nodes):
+            args = [values[r] for r in refs]
+            if isinstance(f, _CONSTANT_LAST):
+                args.append(f.c)
+            elif isinstance(f, _CONSTANT_FIRST):
+                args.insert(0, f.c)
+            # 最后一次被使用且反向传播不需要的临时数组，可以直接作为out复用（包括原地计算）
+            for r in refs:
+                uses[r] -= 1
+                if r >= n_in and uses[r] == 0 and not self.keep[r]:
+                    x = values[r]
+                    free.setdefault((x.shape, x.dtype), []).append(x)
+            shape = np.broadcast_shapes(*[np.shape(a) for a in args])
+            dtype = np.result_type(*args)
+            buffers = free.get((shape, dtype))
+            if j != last and buffers:  # 最终输出会被返回，必须是新的数组
+                y = _ELEMENTWISE[type(f)](*args, out=buffers.pop())
+            else:
+                y = as_array(_ELEMENTWISE[type(f)](*args))
+            values.append(y)
+        self.save_for_backward(*values)
+        return values[-1]
+
+    def backward_array(self, gy):
+        n_in = self.n_inputs
+        values = self.saved_tensors
+        grads = [None] * len(values)
+        grads[-1] = gy
+        for j in range(len(self.nodes) - 1, -1, -1):
+            g = grads[n_in + j]
+            if g is None:
+                continue
+            f, refs = self.nodes[j]
+            xs = [values[r] for r in refs]
+            gxs = _ELEMENTWISE_GRAD[type(f)](f, xs, g)
+            for r, x, gx in zip(refs, xs, gxs):
+                if np.shape(gx) != x.shape:  # for broadcast
+                    gx = utils.sum_to(gx, x.shape)
+                grads[r] = gx if grads[r] is None else grads[r] + gx
+        return tuple(grads[:n_in])
+
+
+def fuse_elementwise(program):
+    # 把连续的逐元素运算合并成一个FusedElementwise节点。
+    # 只有当中间结果只被链上的下一个运算使用时才合并，这样融合后的节点只有一个输出
+    uses = [0] * program.n_slots
+    for f, ins, outs in program.ops:
+        for i in ins:
+            uses[i] += 1
+    for o in program.outputs:
+        uses[o] += 1
+
+    groups = []  # 每组是ops中的下标
+    tails = {}   # 组的最终输出槽位 -> 组
+    for k, (f, ins, outs) in enumerate(program.ops):
+        if type(f) not in _ELEMENTWISE:
+            continue
+        group = None
+        for i in ins:
+            if i in tails and uses[i] == 1:
+                group = tails.pop(i)
+                break
+        if group is None:
+            group = []
+            groups.append(group)
+        group.append(k)
+        tails[outs[0]] = group
+
+    fused = {}  # 组内最后一个运算的下标 -> 融合后的运算
+    members = set()
+    for group in groups:
+        if len(group) < 2:
+            continue
+        produced = {}
+        ext_slots = []
+        nodes = []
+        for j, k in enumerate(group):
+            f, ins, outs = program.ops[k]
+            for i in ins:
+                if i not in produced and i not in ext_slots:
+                    ext_slots.append(i)
+            nodes.append((f, ins))
+            produced[outs[0]] = j
+        n_in = len(ext_slots)
+        nodes = [(f, [n_in + produced[i] if i in produced else ext_slots.index(i)
+                      for i in ins]) for f, ins in nodes]
+        tail = program.ops[group[-1]][2]
+        fused[group[-1]] = (FusedElementwise(nodes, n_in), ext_slots, tail)
+        members.update(group)
+
+    ops = []
+    for k, op in enumerate(program.ops):
+        if k in fused:
+            ops.append(fused[k])
+        elif k not in members:
+            ops.append(op)
+    return Program(ops, program.n_inputs, program.leaves, program.outputs,
+                   program.n_slots)
+
+
+class TracedGraph(Function):
+    __slots__ = ('program', 'values', 'saved')
+
+    def __init__(self, program):
+        self.program = program
+
+    def forward(self, *xs):
+        self.values, self.saved = self.program.forward(xs)
+        ys = tuple(self.values[o] for o in self.program.outputs)
+        return ys[0] if len(ys) == 1 else ys
+
+    def backward_array(self, *gys):
+        gys = [np.zeros_like(self.values[o]) if gy is None else gy
+               for o, gy in zip(self.program.outputs, gys)]
+        return tuple(self.program.backward(self.values, self.saved, gys))
+
+    def backward(self, *gys):
+        # 记录的图在ndarray上重放，得到的梯度不能再继续求导
+        if Config.enable_backprop:
+            raise NotImplementedError('traced functions do not support create_graph; '
+                                      'call the function without dezero.trace')
+        if Config.tangents is not None:
+            raise NotImplementedError('traced functions do not support jvp/hvp; '
+                                      'call the function without dezero.trace')
+        gxs = self.backward_array(*[None if gy is None else gy.data for gy in gys])
+        return tuple(None if gx is None else Variable(as_array(gx)) for gx in gxs)
+
+    def jvp(self, *tangents):
+        raise NotImplementedError('traced functions do not support jvp/hvp; '
+                                  'call the function without dezero.trace')
+
+
+# =============================================================================
+# 标量计算图：生成直接在Python的float上执行的代码
+# =============================================================================
+# 0维数组上的每个NumPy运算都有约1us的固定开销，远大于计算本身（rosenbrock、牛顿法等）
+# 前向的表达式：{0}、{1}是输入，{c}是函数的常量属性
+_SCALAR_FORWARD = {
+    Add: '{0} + {1}',
+    Sub: '{0} - {1}',
+    Mul: '{0} * {1}',
+    Div: '{0} / {1}',
+    Neg: '-{0}',
+    Pow: '{0} ** {c}',
+    AddConstant: '{0} + {c}',
+    SubConstant: '{0} - {c}',
+    RSubConstant: '{c} - {0}',
+    MulConstant: '{0} * {c}',
+    DivConstant: '{0} / {c}',
+    RDivConstant: '{c} / {0}',
+    Sin: 'sin({0})',
+    Cos: 'cos({0})',
+    Tanh: 'tanh({0})',
+    Exp: 'exp({0})',
+    Log: 'log({0})',
+    Sigmoid: '0.5 * tanh(0.5 * {0}) + 0.5',
+}
+
+# 每个输入的梯度：{g}是输出的梯度，{y}是输出
+_SCALAR_GRAD = {
+    Add: ('{g}', '{g}'),
+    Sub: ('{g}', '-{g}'),
+    Mul: ('{g} * {1}', '{g} * {0}'),
+    Div: ('{g} / {1}', '{g} * (-{0} / {1} ** 2)'),
+    Neg: ('-{g}',),
+    Pow: ('{c} * {0} ** ({c} - 1) * {g}',),
+    AddConstant: ('{g}',),
+    SubConstant: ('{g}',),
+    RSubConstant: ('-{g}',),
+    MulConstant: ('{g} * {c}',),
+    DivConstant: ('{g} / {c}',),
+    RDivConstant: ('{g} * (-{c} / {0} ** 2)',),
+    Sin: ('{g} * cos({0})',),
+    Cos: ('{g} * -sin({0})',),
+    Tanh: ('{g} * (1 - {y} * {y})',),
+    Exp: ('{g} * {y}',),
+    Log: ('{g} / {0}',),
+    Sigmoid: ('{g} * {y} * (1 - {y})',),
+}
+
+def _is_scalar(f):
+    if type(f) not in _SCALAR_FORWARD:
+        return False
+    if isinstance(f, Pow):
+        # 小数指数作用在负数上时Python会得到复数，只处理整数指数
+        return isinstance(f.c, (int, np.integer)) and not isinstance(f.c, bool)
+    return True
+
+
+class ScalarProgram:
+    def __init__(self, program):
+        self.program = program  # 出现除以0、log(0)等异常时退回到ndarray上执行
+        self.outputs = program.outputs
+        n_args = program.n_inputs + len(program.leaves)
+        namespace = {'sin': math.sin, 'cos': math.cos, 'tanh': math.tanh,
+                     'exp': math.exp, 'log': math.log}
+        args = ['v{}'.format(i) for i in range(n_args)]
+        values = ', '.join('v{}'.format(i) for i in range(program.n_slots))
+
+        forward = ['def forward({}):'.format(', '.join(args))]
+        for k, (f, ins, outs) in enumerate(program.ops):
+            c = None
+            if hasattr(f, 'c'):
+                c = 'c{}'.format(k)
+                namespace[c] = int(f.c) if isinstance(f, Pow) else float(f.c)
+            expr = _SCALAR_FORWARD[type(f)].format(*['v{}'.format(i) for i in ins], c=c)
+            forward.append('    v{} = {}'.format(outs[0], expr))
+        forward.append('    return ({},)'.format(values))
+
+        gys = ['gy{}'.format(j) for j in range(len(program.outputs))]
+        backward = ['def backward(values, {}):'.format(', '.join(gys)),
+                    '    {}, = values'.format(values)]
+        defined = set()
+
+        def accumulate(i, expr):
+            if i in defined:
+                backward.append('    g{0} = g{0} + {1}'.format(i, expr))
+            else:
+                backward.append('    g{} = {}'.format(i, expr))
+                defined.add(i)
+        for o, gy in zip(program.outputs, gys):
+            accumulate(o, gy)
+        for k in range(len(program.ops) - 1, -1, -1):
+            f, ins, outs = program.ops[k]
+            o = outs[0]
+            if o not in defined:  # 不影响输出的运算
+                continue
+            c = 'c{}'.format(k) if hasattr(f, 'c') else None
+            for i, expr in zip(ins, _SCALAR_GRAD[type(f)]):
+                accumulate(i, expr.format(*['v{}'.format(i) for i in ins], c=c,
+                                          g='g{}'.format(o), y='v{}'.format(o)))
+        backward.append('    return ({},)'.format(', '.join(
+            'g{}'.format(i) if i in defined else 'None' for i in range(n_args))))
+
+        self.source = '\n'.join(forward + [''] + backward)
+        exec(compile(self.source, '<scalar program>', 'exec'), namespace)
+        self.forward = namespace['forward']
+        self.backward = namespace['backward']
+
+
+class ScalarGraph(TracedGraph):
+    __slots__ = ('scalar', 'xs', 'scalar_values')
+
+    def __init__(self, scalar):
+        self.scalar = scalar
+        self.program = scalar.program
+
+    def forward(self, *xs):
+        self.xs = xs
+        try:
+            self.scalar_values = self.scalar.forward(*[float(x) for x in xs])
+        except (ArithmeticError, ValueError):
+            # Python的float在这些情况下抛出异常，NumPy得到inf/nan
+            self.scalar_values = None
+            return super().forward(*xs)
+        ys = tuple(np.array(self.scalar_values[o]) for o in self.scalar.outputs)
+        return ys[0] if len(ys) == 1 else ys
+
+    def backward_array(self, *gys):
+        if self.scalar_values is not None:
+            try:
+                gxs = self.scalar.backward(self.scalar_values,
+                                           *[0.0 if gy is None else float(gy) for gy in gys])
+                return tuple(None if gx is None else np.array(gx) for gx in gxs)
+            except (ArithmeticError, ValueError):
+                self.scalar_values = None
+                self.values, self.saved = self.program.forward(self.xs)
+        return super().backward_array(*gys)
+
+
+class TracedFunction:
+    def __init__(self, fn, fuse=False, scalar=True):
+        self.fn = fn
+        self.fuse = fuse
+        self.scalar = scalar
+        self.programs = {}  # 按输入的形状和类型缓存记录结果
+
+    def __call__(self, *inputs):
+        inputs = [as_variable(x) for x in inputs]
+        key = tuple((x.shape, x.dtype) for x in inputs)
+        program = self.programs.get(key)
+        if program is None:
+            program = Program.record(self.fn, inputs)
+            if self.scalar and program.scalar:
+                program = ScalarProgram(program)
+            elif self.fuse:
+                program = fuse_elementwise(program)
+            self.programs[key] = program
+        # 整个记录下来的图作为一个函数节点，参数W、b等作为额外的输入
+        if isinstance(program, ScalarProgram):
+            return ScalarGraph(program)(*inputs, *program.program.leaves)
+        return TracedGraph(program)(*inputs, *program.leaves)
+
+
+def trace(fn, fuse=False, scalar=True):
+    # 第一次调用时记录fn的计算图，之后按记录的顺序在ndarray上重放前向和反向
+    # 要求fn的计算图结构只由输入的形状决定（不能有依赖数据的分支）
+    # fuse=True时把连续的逐元素运算合并成一个节点
+    # scalar=True时，所有值都是0维float64的计算图生成在Python的float上执行的代码
+    return TracedFunction(fn, fuse, scalar)
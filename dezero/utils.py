@@ -1,7 +1,10 @@
 # 函数名前添加下划线表示只在本文件中使用此函数
 # verbose参数表示是否显示变量的形状和数据类型
 import os
+import io
 import subprocess
+import warnings
+import numpy as np
 
 def _dot_var(v, verbose=False):
     _dot_var = '{} [label = "{}", color=orange, style=filled]\n'
@@ -14,54 +17,144 @@ def _dot_var(v, verbose=False):
     return _dot_var.format(id(v), name)
 
 def _dot_func(f):
+    # 只输出函数节点，边由write_dot_graph去重后输出
     _dot_func = '{} [label = "{}", color=lightblue, style=filled, shape=box]\n'
-    ret = _dot_func.format(id(f), f.__class__.__name__)
+    return _dot_func.format(id(f), f.__class__.__name__)
+
+# 计算图的记录信息，不属于函数做什么计算
+_GRAPH_FIELDS = ('inputs', '_inputs', 'outputs', 'generation', 'serial', 'saved_tensors',
+                 'saved_slots', '__weakref__', '__dict__')
+
+def _attr_key(v):
+    # 能按值比较的属性转换为可哈希的键，不能安全比较的（函数、大数组等）返回None
+    if v is None or isinstance(v, (bool, int, float, complex, str, np.generic)):
+        return (type(v).__name__, v)
+    if isinstance(v, np.dtype):
+        return ('dtype', v.str)
+    if isinstance(v, (tuple, list)):
+        keys = tuple(_attr_key(a) for a in v)
+        return None if None in keys else (type(v).__name__, keys)
+    if isinstance(v, np.ndarray) and v.size <= 64:
+        return ('ndarray', v.dtype.str, v.shape, v.tobytes())
+    return None
+
+def _func_key(f):
+    # 函数的类型和属性（形状、指数等），用于判断两个函数是否做同样的计算。
+    # 没有声明__slots__的子类，属性保存在__dict__中，也要比较。
+    # 有属性不能安全比较时返回None，这样的函数不与其他函数合并
+    names = [name for cls in type(f).__mro__ for name in getattr(cls, '__slots__', ())]
+    names.extend(getattr(f, '__dict__', ()))
+    attrs = []
+    for name in names:
+        if name in _GRAPH_FIELDS or not hasattr(f, name):
+            continue
+        key = _attr_key(getattr(f, name))
+        if key is None:
+            return None
+        attrs.append((name, key))
+    return (type(f).__module__, type(f).__qualname__, tuple(attrs))
+
+def write_dot_graph(output, file, verbose=True, collapse=False):
+    """Write the computational graph of `output` to `file` in DOT format.
 
-    dot_edges = '{} -> {}\n'
-    for x in f.inputs:
-        ret += dot_edges.format(id(x), id(f))
-    for y in f.outputs:
-        ret += dot_edges.format(id(f), id(y()))
-    return ret
-
-def get_dot_graph(output, verbose=True):
-    txt = ''
+    Args:
+        output (dezero.Variable): Output variable of the graph.
+        file: Text file object the graph is streamed into.
+        verbose (bool): Show shapes and dtypes of variables.
+        collapse (bool): Merge repeated subgraphs, i.e. functions of the
+            same type and attributes applied to the same inputs.
+    """
+    write = file.write
     funcs = []
     seen_set = set()
-
-    def add_func(f):
+    stack = [] if output.creator is None else [output.creator]
+    while stack:
+        f = stack.pop()
         if f not in seen_set:
-            funcs.append(f)
             seen_set.add(f)
-
-    add_func(output.creator)
-    txt += _dot_var(output, verbose)
-    while funcs:
-        f = funcs.pop()
-        txt += _dot_func(f)
+            funcs.append(f)
+            stack.extend(x.creator for x in f.inputs if x.creator is not None)
+
+    rep = {}  # id(变量或函数) -> 合并后代表它的对象
+    if collapse:
+        # 按世代从小到大处理，输入的代表先确定，再合并相同的函数
+        funcs.sort(key=lambda f: f.generation)
+        canonical = {}
+        for f in funcs:
+            for x in f.inputs:
+                # 没有名字的标量叶子变量（常数）按值合并
+                if x.creator is None and x.name is None and x.data is not None \
+                        and x.data.ndim == 0:
+                    rep[id(x)] = canonical.setdefault(
+                        ('const', x.data.dtype.str, x.data.item()), x)
+            fkey = _func_key(f)
+            if fkey is None:
+                continue
+            key = (fkey, tuple(id(rep.get(id(x), x)) for x in f.inputs))
+            g = canonical.setdefault(key, f)
+            rep[id(f)] = g
+            if g is not f:
+                for y, z in zip(f.outputs, g.outputs):
+                    if y() is not None and z() is not None:
+                        rep[id(y())] = z()
+
+    seen_nodes = set()
+    seen_edges = set()
+
+    def add_var(v):
+        v = rep.get(id(v), v)
+        if id(v) not in seen_nodes:
+            seen_nodes.add(id(v))
+            write(_dot_var(v, verbose))
+        return v
+
+    def add_edge(a, b):
+        if (id(a), id(b)) not in seen_edges:
+            seen_edges.add((id(a), id(b)))
+            write('{} -> {}\n'.format(id(a), id(b)))
+
+    write('digraph g {\n')
+    add_var(output)
+    for f in funcs:
+        g = rep.get(id(f), f)
+        if id(g) not in seen_nodes:
+            seen_nodes.add(id(g))
+            write(_dot_func(g))
         for x in f.inputs:
-            txt += _dot_var(x, verbose)
-            if x.creator is not None:
-                add_func(x.creator)
-    
-    return 'digraph g {\n' + txt + '}'
-
-def plot_dot_graph(output, verbose=True, to_file='graph.png'):
-    dot_graph = get_dot_graph(output, verbose)
-
-    # 将dot数据保存至文件
-    tmp_dir = os.path.join(os.path.expanduser('~'), '.dezero')
-    if not os.path.exists(tmp_dir):
-        os.mkdir(tmp_dir)
-    graph_path = os.path.join(tmp_dir, 'tmp_graph.dot')
-
-    with open(graph_path, 'w') as f:
-        f.write(dot_graph)
-
-    # 调用dot命令
+            add_edge(add_var(x), g)
+        for y in f.outputs:
+            y = y()
+            if y is not None:
+                add_edge(g, add_var(y))
+    write('}')
+
+def get_dot_graph(output, verbose=True, collapse=False):
+    f = io.StringIO()
+    write_dot_graph(output, f, verbose, collapse)
+    return f.getvalue()
+
+def plot_dot_graph(output, verbose=True, to_file='graph.png', collapse=False):
+    # 通过标准输入把dot数据直接传给dot命令，不再经过临时文件和shell
     extension = os.path.splitext(to_file)[1][1:]  # 获取扩展名
-    cmd = 'dot {} -T {} -o {}'.format(graph_path, extension, to_file)
-    subprocess.run(cmd, shell=True)  # shell=True表示通过shell来执行cmd命令
+    try:
+        proc = subprocess.Popen(['dot', '-T', extension, '-o', to_file],
+                                stdin=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except FileNotFoundError:
+        # 没有安装Graphviz时只给出警告，不中断调用者（例如steps中的示例）
+        warnings.warn('Graphviz is not installed (the dot command was not found); '
+                      '{} was not written'.format(to_file))
+        return
+    try:
+        write_dot_graph(output, proc.stdin, verbose, collapse)
+        proc.stdin.close()
+    except BrokenPipeError:
+        pass  # dot提前退出，原因在它的错误输出中
+    finally:
+        err = proc.stderr.read()
+        proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError('dot failed with exit status {} while writing {}: {}'.format(
+            proc.returncode, to_file, err.strip()))
 
 def sum_to(x, shape):
     """Sum elements along axes to output an array of a given shape.
@@ -112,4 +205,22 @@ def reshape_sum_backward(gy, x_shape, axis, keepdims):
         shape = gy.shape
 
     gy = gy.reshape(shape)  # reshape
-    return gy
\ No newline at end of file
+    return gy
+
+def logsumexp(x, axis=1):
+    """Compute log(sum(exp(x))) along the axis without overflow.
+
+    Args:
+        x (ndarray): Input array.
+        axis (int): Axis to reduce.
+
+    Returns:
+        ndarray: Output array with the reduced axis kept as size 1.
+    """
+    m = x.max(axis=axis, keepdims=True)
+    y = x - m
+    np.exp(y, out=y)
+    s = y.sum(axis=axis, keepdims=True)
+    np.log(s, out=s)
+    m += s
+    return m